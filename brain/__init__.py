@@ -2,8 +2,14 @@ from .module import Module as Module
 from .jacks import Jack as Jack
 from .jacks import InputJack as InputJack
 from .jacks import OutputJack as OutputJack
+from .stats import JackStats as JackStats
+from .stats import SenderStats as SenderStats
+from .stats import SchedulerStats as SchedulerStats
+from .stats import ClockStats as ClockStats
 from .interfaces import PatchState as PatchState
 from .interfaces import EventHandler as EventHandler
+from .protocol import SampleFormat as SampleFormat
+from .concealment import Concealment as Concealment
 
 from .constants import PREFERRED_BROADCAST as PREFERRED_BROADCAST
 from .constants import PATCH_PORT as PATCH_PORT
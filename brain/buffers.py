@@ -0,0 +1,306 @@
+import math
+import numpy as np
+
+from typing import Optional
+
+from .constants import (
+    BLOCK_SIZE,
+    CHANNELS,
+    JACK_RING_SIZE,
+    JITTER_MAX_DEPTH,
+    JITTER_MIN_DEPTH,
+    JITTER_TARGET_DEPTH,
+    SAMPLE_RATE,
+)
+from .formats import SAMPLE_WIDTHS, wire_view
+from .protocol import SampleFormat
+from .stats import JackStats
+
+
+class JitterBuffer:
+    """Reorders incoming sample blocks by sequence number and plays them out with a bounded delay.
+
+    Blocks are stored in a single preallocated array of shape (``JACK_RING_SIZE + 2``,
+    ``block_size``, ``CHANNELS``). Datagrams are written straight into a free slot, which is then
+    swapped into place by its sequence number, so no memory is allocated per block in steady state.
+
+    The buffer waits until it holds ``target_depth`` blocks before it starts playing. The target is
+    adapted within [``min_depth``, ``max_depth``] from the measured inter-arrival jitter: it grows
+    as soon as the jitter increases and shrinks by one block at most once a second. If the latency
+    grows past the target, the oldest blocks are dropped to catch back up.
+
+    For streams sent with forward error correction, the parity of each group of blocks is kept
+    alongside, and a block of the group that is missing when due to be played is rebuilt from it
+    if all of the others arrived.
+
+    :param target_depth: Initial number of blocks to buffer before playing
+
+    :param min_depth: Smallest number of blocks the target may shrink to
+
+    :param max_depth: Largest number of blocks that may be buffered
+
+    :param header_size: Number of bytes reserved in front of each block for the datagram header
+
+    :param stats: Counters to update, shared with the owning jack
+
+    :param block_size: Number of samples per channel in each block
+
+    :param sample_format: Encoding of the samples, which are stored as received
+    """
+
+    #: Number of blocks above the target depth tolerated before dropping
+    headroom = 2
+
+    def __init__(
+        self,
+        target_depth: int = JITTER_TARGET_DEPTH,
+        min_depth: int = JITTER_MIN_DEPTH,
+        max_depth: int = JITTER_MAX_DEPTH,
+        header_size: int = 0,
+        stats: Optional[JackStats] = None,
+        block_size: int = BLOCK_SIZE,
+        sample_format: SampleFormat = SampleFormat.INT16,
+    ):
+        assert 0 < min_depth <= target_depth <= max_depth < JACK_RING_SIZE
+        self.size = JACK_RING_SIZE
+        self.block_size = block_size
+        # Blocks per second, the interval at which the target depth may shrink
+        self.block_rate = SAMPLE_RATE // block_size
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.stats = stats or JackStats()
+        self.stats.target_depth = target_depth
+
+        # Two extra slots are kept outside of the ring: one to receive into and one holding the
+        # most recently played block, which must stay intact while it may still be read.
+        block_bytes = block_size * CHANNELS * SAMPLE_WIDTHS[sample_format]
+        self.frames = np.zeros((self.size + 2, header_size + block_bytes), np.uint8)
+        self.payloads = self.frames[:, header_size:]
+        self.blocks = wire_view(self.payloads, sample_format, block_size)
+        # Parity of the groups of blocks of streams sent with forward error correction, indexed by
+        # group number
+        self.parities = np.zeros((self.size, block_bytes), np.uint8)
+        self.group_size: Optional[int] = None
+        self.slots = [memoryview(frame) for frame in self.frames]
+        self.positions = list(range(self.size))
+        self.free = [self.size, self.size + 1]
+        self.last_index = self.size + 1
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets all buffered blocks, for instance when connecting to a new stream"""
+        self.sequences = [None] * self.size
+        self.parity_sequences = [None] * self.size
+        self.read_sequence: Optional[int] = None
+        self.newest_sequence: Optional[int] = None
+        self.playing = False
+        self.last_transit: Optional[float] = None
+        self.newest_arrival: Optional[float] = None
+        self.jitter = 0.0
+        self.blocks_since_shrink = 0
+
+    def __len__(self) -> int:
+        if self.read_sequence is None:
+            return 0
+        return max(self.newest_sequence - self.read_sequence + 1, 0)
+
+    @property
+    def target_depth(self) -> int:
+        return self.stats.target_depth
+
+    def write_slot(self) -> memoryview:
+        """Raw byte view of the free slot, including its header, that the next datagram should be
+        written to. The slot only becomes part of the buffer once ``insert`` is called.
+        """
+        if self.free[0] == self.last_index:
+            self.free.reverse()
+        return self.slots[self.free[0]]
+
+    def write_block(self) -> np.ndarray:
+        """Sample view of the free slot, for blocks that arrive without a datagram header. As with
+        ``write_slot``, the block only becomes part of the buffer once ``insert`` is called.
+        """
+        self.write_slot()
+        return self.blocks[self.free[0]]
+
+    def insert(self, sequence: int, timestamp: int, arrival: float) -> bool:
+        """Adds the block written into ``write_slot`` to the buffer.
+
+        :param sequence: 32-bit sequence number of the block
+
+        :param timestamp: Sender's sample clock at the start of the block
+
+        :param arrival: Local time in seconds that the block was received
+
+        :return: ``True`` if the block was stored, or ``False`` if it was late or a duplicate
+        """
+        if self.newest_sequence is not None:
+            sequence = self.unwrap(sequence)
+            if sequence < self.read_sequence - self.size:
+                # The stream jumped far backwards, which most likely means the output restarted
+                self.reset()
+            elif (
+                sequence < self.read_sequence
+                or self.sequences[sequence % self.size] == sequence
+            ):
+                self.stats.reordered += 1
+                return False
+
+        if self.newest_sequence is None:
+            self.read_sequence = self.newest_sequence = sequence
+        elif sequence - self.read_sequence >= self.size:
+            self.drop(sequence - self.target_depth + 1 - self.read_sequence)
+
+        position = sequence % self.size
+        self.positions[position], self.free[0] = self.free[0], self.positions[position]
+        self.sequences[position] = sequence
+        if sequence >= self.newest_sequence:
+            self.newest_sequence = sequence
+            self.newest_arrival = arrival
+        self.stats.received += 1
+        self.update_jitter(timestamp, arrival)
+        return True
+
+    def held(self, sequence: int) -> Optional[np.ndarray]:
+        """A view of a block still held by the buffer, which may already have been played, or
+        ``None`` if it is not
+
+        :param sequence: 32-bit sequence number of the block
+        """
+        if self.newest_sequence is None:
+            return None
+        sequence = self.unwrap(sequence)
+        position = sequence % self.size
+        if self.sequences[position] != sequence:
+            return None
+        return self.blocks[self.positions[position]]
+
+    def unwrap(self, sequence: int) -> int:
+        """Unwraps a 32-bit sequence number relative to the newest block seen so far"""
+        delta = (sequence - self.newest_sequence + 0x80000000) % 0x100000000
+        return self.newest_sequence + delta - 0x80000000
+
+    def insert_parity(self, parity: np.ndarray, sequence: int, count: int) -> None:
+        """Keeps the parity of a group of consecutive blocks, from which a single missing block of
+        the group is rebuilt when it is due to be played.
+
+        :param parity: Payload bytes of the parity frame, which are copied
+
+        :param sequence: 32-bit sequence number of the first block of the group, a multiple of
+            ``count``
+
+        :param count: Number of blocks in the group
+        """
+        if self.newest_sequence is None:
+            return
+        first = self.unwrap(sequence)
+        if first + count <= self.read_sequence:
+            return
+        self.group_size = count
+        slot = first // count % self.size
+        np.copyto(self.parities[slot], parity)
+        self.parity_sequences[slot] = first
+
+    def recover(self, sequence: int) -> bool:
+        """Rebuilds a missing block from the parity of its group if every other block of the
+        group arrived. The parity is the XOR of the payloads of the group, so XOR-ing it with the
+        other blocks leaves the missing one.
+
+        :return: ``True`` if the block was rebuilt
+        """
+        count = self.group_size
+        if count is None:
+            return False
+        first = sequence - sequence % count
+        slot = first // count % self.size
+        if self.parity_sequences[slot] != first:
+            return False
+        for current in range(first, first + count):
+            if current != sequence and self.sequences[current % self.size] != current:
+                return False
+
+        self.write_slot()
+        payload = self.payloads[self.free[0]]
+        np.copyto(payload, self.parities[slot])
+        for current in range(first, first + count):
+            if current != sequence:
+                other = self.payloads[self.positions[current % self.size]]
+                np.bitwise_xor(payload, other, out=payload)
+        position = sequence % self.size
+        self.positions[position], self.free[0] = self.free[0], self.positions[position]
+        self.sequences[position] = sequence
+        self.stats.recovered += 1
+        return True
+
+    def update_jitter(self, timestamp: int, arrival: float) -> None:
+        """Estimates the inter-arrival jitter as in RFC 3550 and adapts the target depth to it"""
+        transit = arrival * SAMPLE_RATE - timestamp
+        if self.last_transit is not None:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16
+        self.last_transit = transit
+        self.stats.jitter = self.jitter
+
+        desired = math.ceil(3 * self.jitter / self.block_size) + 1
+        desired = min(max(desired, self.min_depth), self.max_depth)
+        self.blocks_since_shrink += 1
+        if desired > self.target_depth:
+            self.stats.target_depth = desired
+        elif (
+            desired < self.target_depth and self.blocks_since_shrink >= self.block_rate
+        ):
+            self.stats.target_depth -= 1
+            self.blocks_since_shrink = 0
+
+    def fill(self, now: float) -> float:
+        """Number of blocks buffered, with the time since the newest block arrived counted as the
+        part of the next one already on its way. Unlike ``len``, this changes smoothly as the
+        sender and receiver drift apart.
+
+        :param now: Local time in seconds, on the same clock as the arrival times
+        """
+        if self.newest_arrival is None:
+            return len(self)
+        elapsed = (now - self.newest_arrival) * self.block_rate
+        return len(self) + min(max(elapsed, 0.0), 1.0)
+
+    def drop(self, count: int) -> None:
+        """Skips the oldest ``count`` blocks"""
+        self.read_sequence += count
+        self.stats.dropped += count
+
+    def pop(self) -> Optional[np.ndarray]:
+        """Plays out the next block in sequence.
+
+        :return: A view into the buffer of shape (``block_size``, ``CHANNELS``), or ``None`` if the
+            block is missing or the buffer is still filling. The view is only valid until the next
+            block is written.
+        """
+        depth = len(self)
+        if self.read_sequence is None or (
+            not self.playing and depth < self.target_depth
+        ):
+            self.stats.depth = depth
+            return None
+        self.playing = True
+
+        if depth > self.target_depth + self.headroom or depth > self.max_depth:
+            self.drop(depth - self.target_depth)
+            depth = self.target_depth
+        self.stats.depth = depth
+        if depth == 0:
+            self.playing = False
+            self.stats.underruns += 1
+            return None
+
+        sequence = self.read_sequence
+        position = sequence % self.size
+        self.read_sequence += 1
+        if self.sequences[position] != sequence and not self.recover(sequence):
+            self.stats.lost += 1
+            return None
+        self.last_index = self.positions[position]
+        return self.blocks[self.last_index]
+
+    def last(self) -> np.ndarray:
+        """A view of the most recently played block"""
+        return self.blocks[self.last_index]
@@ -0,0 +1,101 @@
+# Every module keeps a network clock that follows the elected leader, so that block N starts at the
+# same moment on every module rather than wherever each local clock happens to be. The exchange
+# mirrors PTP's delay request-response mechanism over the existing heartbeats:
+#
+#   leader                 follower
+#     t1  --- Heartbeat ---->  t2
+#     t4  <-- Response -----  t3
+#     next Heartbeat carries t4
+#
+# With a symmetric path, the follower is ahead of the leader by ((t2 - t1) - (t4 - t3)) / 2 and the
+# one-way delay is ((t2 - t1) + (t4 - t3)) / 2. Followers step their clock on the first measurement
+# (or a large error) and afterwards slew it with a proportional-integral loop, which also learns the
+# rate difference between the two oscillators. The leader's clock is never corrected, and a newly
+# elected leader simply carries on from where its disciplined clock was.
+
+from collections import deque
+from typing import Callable, Deque, Final, Tuple
+
+from .stats import ClockStats
+
+
+class NetworkClock:
+    """A local clock disciplined towards the leader's network time
+
+    :param local: Local clock in seconds
+    """
+
+    #: Errors larger than this (in seconds) are stepped rather than slewed
+    step_threshold: Final = 0.005
+    #: Fraction of the measured error corrected at once
+    offset_gain: Final = 0.25
+    #: Fraction of the measured error per second of interval added to the rate correction
+    drift_gain: Final = 0.05
+    #: Number of recent measurements whose smallest round trip sets the acceptance bound
+    filter_size: Final = 8
+    #: Measurements whose delay exceeds the smallest recent delay by more than this are discarded,
+    #: since the extra time was most likely spent queued on one side only
+    delay_tolerance: Final = 0.001
+
+    def __init__(self, local: Callable[[], float]):
+        self.local = local
+        self.offset = 0.0
+        self.drift = 0.0
+        self.reference = 0.0
+        self.last_correction = None
+        self.delays: Deque[float] = deque(maxlen=self.filter_size)
+        self.stats = ClockStats()
+
+    def time(self) -> float:
+        """Current network time in seconds"""
+        now = self.local()
+        return now + self.offset + self.drift * (now - self.reference)
+
+    def to_local(self, network_time: float) -> float:
+        """Local time at which the network clock reaches ``network_time``"""
+        return (network_time - self.offset + self.drift * self.reference) / (
+            1 + self.drift
+        )
+
+    def rebase(self) -> float:
+        """Folds the rate correction accumulated so far into the offset"""
+        now = self.local()
+        self.offset += self.drift * (now - self.reference)
+        self.reference = now
+        return now
+
+    def measure(
+        self, t1: float, t2: float, t3: float, t4: float
+    ) -> Tuple[float, float]:
+        """Applies the timestamps of one exchange with the leader, where ``t2`` and ``t3`` were read
+        from this clock and ``t1`` and ``t4`` from the leader's
+
+        :return: The measured error and one-way delay in seconds
+        """
+        error = ((t2 - t1) - (t4 - t3)) / 2
+        delay = ((t2 - t1) + (t4 - t3)) / 2
+        self.delays.append(delay)
+        if delay > min(self.delays) + self.delay_tolerance:
+            self.stats.discarded += 1
+            return error, delay
+        self.correct(error)
+        self.stats.error = error
+        self.stats.delay = delay
+        return error, delay
+
+    def correct(self, error: float) -> None:
+        """Corrects the clock for being ``error`` seconds ahead of the leader"""
+        now = self.rebase()
+        if not self.stats.synchronized or abs(error) > self.step_threshold:
+            self.offset -= error
+            self.drift = 0.0
+            self.delays.clear()
+            self.stats.steps += 1
+            self.stats.synchronized = True
+        else:
+            self.offset -= self.offset_gain * error
+            if self.last_correction is not None and now > self.last_correction:
+                interval = now - self.last_correction
+                self.drift -= self.drift_gain * error / interval
+        self.last_correction = now
+        self.stats.drift = self.drift
@@ -0,0 +1,268 @@
+# Uncompressed streams take about 8 Mb/s each, which only leaves room for 10 or so on a 100 Mb link
+# or Wi-Fi. An output jack can instead compress each block on its own, losslessly and without
+# looking ahead, so a lost block costs nothing more than before and no latency is added. Each
+# channel is predicted from its previous sample, and optionally the residuals of each channel from
+# those of the channel before it, which pays off when several channels carry similar signals. The
+# residuals are Rice coded with the parameter that minimises each channel's size. The low bits of
+# every residual are stored first, with a fixed width per channel, and the unary high parts after
+# them, so that both sections can be packed and unpacked with array operations rather than bit by
+# bit. Blocks that would not come out smaller are sent as they are.
+#
+#   flags | Rice parameter per channel | first sample per channel | low bits | unary high parts
+
+import numpy as np
+import time
+
+from typing import Final, Optional
+
+from .constants import CHANNELS
+from .formats import SAMPLE_WIDTHS, SampleConverter, SampleEncoder, wire_view
+from .protocol import SampleFormat
+from .stats import JackStats
+
+
+class RiceCodec:
+    """Encodes blocks of integer samples into compressed payloads and decodes them again
+
+    :param block_size: Number of samples per channel in each block
+
+    :param sample_format: Format of the samples, which must be an integer one
+
+    :param stats: Counters to update, shared with the owning jack
+    """
+
+    #: Largest Rice parameter, which covers the residuals of 24-bit samples
+    max_parameter: Final = 27
+    #: Flag set when the residuals of each channel are coded relative to the channel before it
+    across_flag: Final = 0x01
+
+    def __init__(self, block_size: int, sample_format: SampleFormat, stats: JackStats):
+        if sample_format == SampleFormat.FLOAT32:
+            raise ValueError("Only integer sample formats can be compressed")
+        self.block_size = block_size
+        self.sample_format = sample_format
+        self.stats = stats
+        width = SAMPLE_WIDTHS[sample_format]
+        #: Number of bytes in an uncompressed block
+        self.payload_size = block_size * CHANNELS * width
+        first_offset = 1 + CHANNELS
+        self.side_size = first_offset + CHANNELS * width
+        self.parameter_bytes = slice(1, first_offset)
+        self.first_bytes = slice(first_offset, self.side_size)
+        # Compressed blocks must leave room for their length in front of them to be worthwhile
+        self.max_bits = max(self.payload_size - self.side_size - 2, 0) * 8
+        self.encoder = SampleEncoder(sample_format, block_size)
+        self.first_encoder = SampleEncoder(sample_format, 1)
+        if sample_format == SampleFormat.INT24:
+            self.first_converter = SampleConverter(sample_format, sample_format, 1)
+
+        count = block_size - 1
+        parameters = self.max_parameter + 1
+        self.samples = np.zeros((CHANNELS, block_size), dtype=np.int64)
+        self.residuals = np.zeros((CHANNELS, count), dtype=np.int64)
+        self.across = np.zeros((CHANNELS, count), dtype=np.int64)
+        self.magnitudes = np.zeros((CHANNELS, count), dtype=np.int64)
+        self.codes = np.zeros((CHANNELS, count), dtype=np.int64)
+        self.signs = np.zeros((CHANNELS, count), dtype=np.int64)
+        self.quotients = np.zeros((CHANNELS, count), dtype=np.int64)
+        self.ends = np.zeros(CHANNELS * count, dtype=np.int64)
+
+        self.parameters = np.arange(parameters, dtype=np.int64)
+        self.shifted = np.zeros((parameters, CHANNELS, count), dtype=np.int64)
+        self.costs = np.zeros((parameters, CHANNELS), dtype=np.int64)
+        self.parameter = np.zeros(CHANNELS, dtype=np.intp)
+        self.channels = np.arange(CHANNELS)
+
+        # Low bits of one channel's residuals, most significant first, and the shift and weight
+        # of each bit for every parameter
+        self.low_bits = np.zeros((count, parameters), dtype=np.int64)
+        self.shifts = [
+            np.arange(k - 1, -1, -1, dtype=np.int64) for k in range(parameters)
+        ]
+        self.powers = [np.left_shift(1, shifts) for shifts in self.shifts]
+
+        # One byte per bit of the payload
+        self.bits = np.zeros(self.max_bits + 8 * (self.side_size + 3), dtype=np.uint8)
+        self.weights = np.array([128, 64, 32, 16, 8, 4, 2, 1], dtype=np.uint8)
+        self.bit_shifts = np.arange(7, -1, -1, dtype=np.uint8)
+
+        self.blocks = 0
+        self.elapsed = 0.0
+        self.raw_bytes = 0
+        self.coded_bytes = 0
+
+    def encode(self, data: np.ndarray, payload: np.ndarray) -> Optional[int]:
+        """Compresses a block into the start of ``payload``
+
+        :param data: Block of shape (``block_size``, ``CHANNELS``) in memory
+
+        :param payload: Array of at least ``payload_size`` bytes
+
+        :return: The number of bytes written, or ``None`` if the block does not compress and
+            should be sent as it is
+        """
+        start = time.perf_counter()
+        size = self.compress(data, payload)
+        self.record(start, size)
+        return size
+
+    def compress(self, data: np.ndarray, payload: np.ndarray) -> Optional[int]:
+        samples, count = self.samples, self.block_size - 1
+        if count == 0:
+            return None
+        np.copyto(self.samples, data.T, casting="unsafe")
+        np.subtract(samples[:, 1:], samples[:, :-1], out=self.residuals)
+        self.across[0] = self.residuals[0]
+        np.subtract(self.residuals[1:], self.residuals[:-1], out=self.across[1:])
+        flags = 0
+        residuals = self.residuals
+        if self.magnitude(self.across) < self.magnitude(self.residuals):
+            flags = self.across_flag
+            residuals = self.across
+
+        # Interleave positive and negative residuals into unsigned codes
+        np.left_shift(residuals, 1, out=self.codes)
+        np.right_shift(residuals, 63, out=self.signs)
+        np.bitwise_xor(self.codes, self.signs, out=self.codes)
+
+        # Size of each channel with each parameter no wider than the largest code: the high parts
+        # in unary with a terminating bit, and the low bits
+        tried = min(int(self.codes.max()).bit_length() + 1, len(self.parameters))
+        parameters, costs = self.parameters[:tried], self.costs[:tried]
+        np.right_shift(
+            self.codes[None], parameters[:, None, None], out=self.shifted[:tried]
+        )
+        np.sum(self.shifted[:tried], axis=2, out=costs)
+        costs += (parameters[:, None] + 1) * count
+        np.argmin(costs, axis=0, out=self.parameter)
+        total = int(costs[self.parameter, self.channels].sum())
+        if total > self.max_bits:
+            return None
+
+        bits = self.bits
+        low_total = 0
+        for channel, k in enumerate(self.parameter):
+            if k == 0:
+                continue
+            end = low_total + count * k
+            low_bits = self.low_bits[:, :k]
+            np.right_shift(self.codes[channel, :, None], self.shifts[k], out=low_bits)
+            np.bitwise_and(low_bits, 1, out=low_bits)
+            bits[low_total:end].reshape(count, k)[...] = low_bits
+            low_total = end
+
+        # The unary parts follow as runs of ones, each ended by a zero
+        np.right_shift(self.codes, self.parameter[:, None], out=self.quotients)
+        self.quotients += 1
+        np.cumsum(self.quotients, out=self.ends)
+        self.ends += low_total - 1
+        padded = -(-total // 8) * 8
+        bits[low_total:padded] = 1
+        bits[self.ends] = 0
+
+        payload[0] = flags
+        payload[self.parameter_bytes] = self.parameter
+        first = wire_view(payload[self.first_bytes], self.sample_format, 1)
+        self.first_encoder.encode(samples[:, :1].T, first)
+        side = self.side_size
+        end = side + padded // 8
+        np.dot(bits[:padded].reshape(-1, 8), self.weights, out=payload[side:end])
+        return end
+
+    def decode(self, payload: np.ndarray, wire: np.ndarray) -> bool:
+        """Expands a compressed block
+
+        :param payload: The compressed bytes
+
+        :param wire: Block viewed by ``wire_view`` to write the samples to
+
+        :return: ``False`` if the payload is malformed
+        """
+        start = time.perf_counter()
+        if not self.expand(payload):
+            return False
+        self.encoder.encode(self.samples.T, wire)
+        self.record(start, len(payload))
+        return True
+
+    def expand(self, payload: np.ndarray) -> bool:
+        samples, count = self.samples, self.block_size - 1
+        size = (len(payload) - self.side_size) * 8
+        if size < 0 or size > len(self.bits) - 8:
+            return False
+        parameters = payload[self.parameter_bytes]
+        if parameters.max() > self.max_parameter:
+            return False
+        np.copyto(self.parameter, parameters)
+        first = wire_view(payload[self.first_bytes], self.sample_format, 1)
+        if self.sample_format == SampleFormat.INT24:
+            first = self.first_converter.convert(first)
+        samples[:, 0] = first[0]
+
+        bits = self.bits
+        side = self.side_size
+        np.right_shift(
+            payload[side:, None], self.bit_shifts, out=bits[:size].reshape(-1, 8)
+        )
+        np.bitwise_and(bits[:size], 1, out=bits[:size])
+        low_total = int(self.parameter.sum()) * count
+        if low_total > size:
+            return False
+        self.codes[...] = 0
+        start = 0
+        for channel, k in enumerate(self.parameter):
+            if k == 0:
+                continue
+            end = start + count * k
+            np.dot(
+                bits[start:end].reshape(count, k),
+                self.powers[k],
+                out=self.codes[channel],
+            )
+            start = end
+
+        ends = np.flatnonzero(bits[low_total:size] == 0)
+        if len(ends) < len(self.ends):
+            return False
+        quotients = self.quotients.reshape(-1)
+        last = len(quotients) - 1
+        quotients[0] = ends[0]
+        np.subtract(ends[1:][:last], ends[:last], out=quotients[1:])
+        quotients[1:] -= 1
+        np.left_shift(self.quotients, self.parameter[:, None], out=self.quotients)
+        np.bitwise_or(self.codes, self.quotients, out=self.codes)
+
+        np.right_shift(self.codes, 1, out=self.residuals)
+        np.bitwise_and(self.codes, 1, out=self.signs)
+        np.negative(self.signs, out=self.signs)
+        np.bitwise_xor(self.residuals, self.signs, out=self.residuals)
+        if payload[0] & self.across_flag:
+            np.cumsum(self.residuals, axis=0, out=self.residuals)
+        samples[:, 1:] = self.residuals
+        np.cumsum(samples, axis=1, out=samples)
+        return True
+
+    def magnitude(self, residuals: np.ndarray) -> int:
+        np.absolute(residuals, out=self.magnitudes)
+        return int(self.magnitudes.sum())
+
+    def record(self, start: float, size: Optional[int]) -> None:
+        """Updates the stats with a block encoded or decoded, or sent as it is if ``size`` is
+        ``None``
+        """
+        self.elapsed += time.perf_counter() - start
+        self.blocks += 1
+        self.raw_bytes += self.payload_size
+        if size is None:
+            self.coded_bytes += self.payload_size
+        else:
+            self.coded_bytes += size
+            self.stats.compressed += 1
+        self.stats.compression = self.raw_bytes / self.coded_bytes
+        self.stats.codec_time = self.elapsed / self.blocks
+
+    def record_raw(self) -> None:
+        """Counts a block of the stream that was received without compression"""
+        self.raw_bytes += self.payload_size
+        self.coded_bytes += self.payload_size
+        self.stats.compression = self.raw_bytes / self.coded_bytes
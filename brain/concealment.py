@@ -0,0 +1,169 @@
+# When the block due to be played has not arrived, an input jack has to make one up. Holding the
+# last block is right for control voltages, but repeating one millisecond of audio produces a
+# 1 kHz buzz. Audio jacks can instead fade out, or continue the waveform by repeating its most
+# recent pitch period (found by normalised cross-correlation, as in the G.711 Appendix I
+# concealment) while fading out more slowly. All channels are handled at once in preallocated
+# arrays, and the pitch search only runs on the first block of each gap.
+
+import numpy as np
+
+from enum import Enum
+from typing import Final
+
+from .constants import CHANNELS, SAMPLE_RATE
+
+
+class Concealment(str, Enum):
+    """How an input jack fills in blocks that are missing from its stream"""
+
+    #: Repeat the last block, which suits control voltages, gates and anything held steady
+    HOLD = "Hold"
+    #: Fade the last block out to silence
+    FADE = "Fade"
+    #: Continue the waveform from its last pitch period while fading out, for audio
+    EXTRAPOLATE = "Extrapolate"
+
+
+class Concealer:
+    """Synthesises the blocks missing from a stream
+
+    :param mode: Strategy used
+
+    :param block_size: Number of samples per channel in each block
+
+    :param sample_type: Numpy type of the samples
+    """
+
+    #: Time constant in seconds of the fade applied by ``FADE``
+    fade_time: Final = 0.002
+    #: Time constant in seconds of the fade applied by ``EXTRAPOLATE``
+    extrapolate_fade_time: Final = 0.01
+    #: Shortest and longest pitch periods searched for, in samples
+    min_period: Final = 24
+    max_period: Final = 480
+    #: Number of the most recent samples matched against earlier ones to find the period
+    window: Final = 96
+
+    def __init__(self, mode: Concealment, block_size: int, sample_type: type):
+        self.mode = mode
+        self.block_size = block_size
+        self.integer = np.issubdtype(sample_type, np.integer)
+        self.block = np.zeros((block_size, CHANNELS), dtype=sample_type)
+        self.scratch = np.zeros((block_size, CHANNELS), dtype=np.float32)
+        self.concealing = False
+        self.gain = 1.0
+
+        fade_time = self.fade_time
+        if mode == Concealment.EXTRAPOLATE:
+            fade_time = self.extrapolate_fade_time
+            self.init_history()
+        # Gain applied to each sample of a block relative to the end of the previous one
+        decay = np.exp(-1 / (fade_time * SAMPLE_RATE))
+        self.ramp = decay ** np.arange(1, block_size + 1, dtype=np.float32)[:, None]
+        self.gains = np.zeros_like(self.ramp)
+
+    def init_history(self) -> None:
+        self.history_size = self.max_period + self.window
+        # Samples are appended until the array is full and the most recent history is then moved
+        # back to the start, so the history is always contiguous
+        self.samples = np.zeros((2 * self.history_size + self.block_size, CHANNELS))
+        self.end = self.history_size
+
+        lags = self.max_period - self.min_period + 1
+        self.correlation = np.zeros((lags, CHANNELS))
+        self.energy = np.zeros((lags, CHANNELS))
+        self.squares = np.zeros((self.history_size, CHANNELS))
+        self.energy_sums = np.zeros((self.history_size + 1, CHANNELS))
+        self.best = np.zeros(CHANNELS, dtype=np.intp)
+        self.period = np.full(CHANNELS, self.max_period, dtype=np.intp)
+
+        self.steps = np.arange(self.block_size, dtype=np.intp)[:, None]
+        self.channels = np.arange(CHANNELS, dtype=np.intp)
+        self.index = np.zeros((self.block_size, CHANNELS), dtype=np.intp)
+        self.continuation = np.zeros((self.block_size, CHANNELS))
+
+    def history(self) -> np.ndarray:
+        start, end = self.end - self.history_size, self.end
+        return self.samples[start:end]
+
+    def append(self, block: np.ndarray) -> None:
+        if self.end + self.block_size > len(self.samples):
+            size = self.history_size
+            self.samples[:size] = self.history()
+            self.end = size
+        start, end = self.end, self.end + self.block_size
+        self.samples[start:end] = block
+        self.end = end
+
+    def played(self, block: np.ndarray) -> None:
+        """Records a block of the stream that arrived and was played"""
+        self.concealing = False
+        if self.mode == Concealment.EXTRAPOLATE:
+            self.append(block)
+
+    def conceal(self, last: np.ndarray) -> np.ndarray:
+        """Synthesises the next block in place of one that is missing
+
+        :param last: The last block that arrived
+
+        :return: The block to play, which is overwritten by the next call
+        """
+        if self.mode == Concealment.HOLD:
+            return last
+        if not self.concealing:
+            self.concealing = True
+            self.gain = 1.0
+            if self.mode == Concealment.EXTRAPOLATE:
+                self.find_period()
+
+        source = last
+        if self.mode == Concealment.EXTRAPOLATE:
+            self.extrapolate()
+            source = self.continuation
+        np.multiply(self.ramp, self.gain, out=self.gains)
+        np.multiply(source, self.gains, out=self.scratch)
+        self.gain = float(self.gains[-1, 0])
+        if self.integer:
+            np.rint(self.scratch, out=self.scratch)
+        np.copyto(self.block, self.scratch, casting="unsafe")
+        return self.block
+
+    def find_period(self) -> None:
+        """Finds the lag at which the earlier history best matches the most recent ``window``
+        samples of each channel
+        """
+        history = self.history()
+        size, window = self.history_size, self.window
+        segments = np.lib.stride_tricks.sliding_window_view(history, window, axis=0)
+        # Segments starting max_period to min_period samples before the most recent window
+        first = size - window - self.max_period
+        stop = size - window - self.min_period + 1
+        recent = segments[size - window]
+        np.einsum("lcw,cw->lc", segments[first:stop], recent, out=self.correlation)
+
+        # Energy of each candidate segment, from running sums of the squared history
+        np.square(history, out=self.squares)
+        self.energy_sums[0] = 0
+        np.cumsum(self.squares, axis=0, out=self.energy_sums[1:])
+        first_end, stop_end = first + window, stop + window
+        np.subtract(
+            self.energy_sums[first_end:stop_end],
+            self.energy_sums[first:stop],
+            out=self.energy,
+        )
+        np.sqrt(self.energy, out=self.energy)
+        self.energy += 1e-9
+        np.divide(self.correlation, self.energy, out=self.correlation)
+        np.argmax(self.correlation, axis=0, out=self.best)
+        np.subtract(self.max_period, self.best, out=self.period)
+
+    def extrapolate(self) -> None:
+        """Repeats the last period of each channel into ``continuation`` and appends it to the
+        history, so that the next block carries on in phase
+        """
+        np.remainder(self.steps, self.period, out=self.index)
+        self.index += self.end - self.period
+        self.index *= CHANNELS
+        self.index += self.channels
+        np.take(self.samples, self.index, out=self.continuation)
+        self.append(self.continuation)
@@ -14,18 +14,45 @@ PATCH_PORT: Final = 19874
 #: Port used for audio data communications
 JACK_PORT: Final = 19991
 
-#: Frequency in packets per second to send audio and CV data
+#: Interval in blocks at which an output jack with no connected inputs still sends a block
+JACK_KEEPALIVE_INTERVAL: Final = 100
+
+#: Maximum number of output blocks sent together in a single system call
+JACK_SEND_BATCH: Final = 64
+
+#: Version of the binary header placed in front of every jack datagram
+JACK_PROTOCOL_VERSION: Final = 2
+
+#: Default frequency in packets per second to send audio and CV data, which a module can lower by
+#: choosing a larger block size
 PACKET_RATE: Final = 1000
 
 #: Audio sample rate in Hz (must be a multiple of ``PACKET_RATE``)
 SAMPLE_RATE: Final = 48000
 
-#: Number of samples in a full-length packet (``SAMPLE_RATE`` / ``PACKET_RATE``)
+#: Default number of samples in a full-length packet (``SAMPLE_RATE`` / ``PACKET_RATE``)
 BLOCK_SIZE: Final = 48
 
 #: Number of independent audio processing channels
 CHANNELS: Final = 8
 
+#: Number of preallocated block slots in each input jack's receive ring (must be larger than
+#: ``JITTER_MAX_DEPTH``)
+JACK_RING_SIZE: Final = 32
+
+#: Default number of blocks an input jack buffers before playing out, to absorb network jitter
+JITTER_TARGET_DEPTH: Final = 2
+
+#: Smallest depth in blocks the adaptive jitter buffer will shrink to
+JITTER_MIN_DEPTH: Final = 1
+
+#: Largest depth in blocks the jitter buffer holds before discarding the oldest blocks
+JITTER_MAX_DEPTH: Final = 16
+
+#: Time in seconds before a block deadline at which ``Module.run`` stops sleeping and spins on the
+#: clock instead, to hide the wakeup latency of the operating system's timers
+SCHEDULER_SPIN_TIME: Final = 0.0005
+
 #: Maximum number of states to buffer
 BUFFER_SIZE: Final = 1
 
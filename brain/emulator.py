@@ -0,0 +1,266 @@
+# An in-memory stand-in for the network, so that patches between many modules can be run in one
+# process without touching real sockets or the wall clock. Every module is given an
+# ``EmulatedHost`` of the same ``EmulatedNetwork``, which keeps a virtual clock and delivers each
+# datagram after the latency, jitter, loss, reordering and bandwidth limit of the link between the
+# two hosts. All randomness is drawn from one seeded generator, so a run can be reproduced exactly.
+
+import heapq
+import itertools
+import random
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .constants import PACKET_RATE
+from .mmsg import MessageBatch
+from .stats import LinkStats
+from .transport import DatagramSocket, Transport
+
+
+def segment(address: str) -> str:
+    """The /24 network that an address is on, which stands for the segment it is attached to"""
+    return address.rsplit(".", 1)[0]
+
+
+@dataclass
+class LinkProfile:
+    """Impairments applied to the datagrams travelling from one host to another. All times are
+    in seconds.
+    """
+
+    #: Fixed one-way delay
+    latency: float = 0.0
+    #: Largest extra delay, drawn uniformly for each datagram
+    jitter: float = 0.0
+    #: Probability that a datagram is lost
+    loss: float = 0.0
+    #: Probability that a datagram is held back by ``reorder_delay``, letting later ones overtake it
+    reorder: float = 0.0
+    reorder_delay: float = 0.002
+    #: Capacity of the link in bits per second, or ``None`` for no limit
+    bandwidth: Optional[float] = None
+    #: Longest time a datagram may wait behind the bandwidth limit before it is dropped
+    queue_limit: float = 0.05
+
+
+@dataclass
+class Link:
+    profile: LinkProfile
+    stats: LinkStats = field(default_factory=LinkStats)
+    busy_until: float = 0.0
+
+
+class EmulatedSocket(DatagramSocket):
+    def __init__(self, network: "EmulatedNetwork", address: str, port: Optional[int]):
+        self.network = network
+        self.address = address
+        self.port = port
+        self.groups: Set[str] = set()
+        # Source that each source-specific group was joined for
+        self.sources: Dict[str, str] = {}
+        self.queue: List[Tuple[float, int, bytes]] = []
+
+    def join(self, group: str, source: Optional[str] = None) -> None:
+        self.groups.add(group)
+        if source is not None:
+            self.sources[group] = source
+
+    def leave(self, group: str, source: Optional[str] = None) -> None:
+        self.groups.discard(group)
+        self.sources.pop(group, None)
+
+    def local_port(self) -> int:
+        return self.port
+
+    def pending(self) -> bytes:
+        if not self.queue or self.queue[0][0] > self.network.now:
+            raise BlockingIOError
+        return heapq.heappop(self.queue)[2]
+
+    def recv(self, bufsize: int) -> bytes:
+        return self.pending()[:bufsize]
+
+    def recv_into(self, buffer: memoryview) -> int:
+        data = self.pending()
+        nbytes = min(len(data), len(buffer))
+        buffer[:nbytes] = data[:nbytes]
+        return nbytes
+
+    def sendto(self, data: bytes, address: Tuple[str, int]) -> None:
+        self.network.send(self.address, data, address)
+
+    def send_batch(self, batch: MessageBatch) -> int:
+        for buffer, address in zip(batch.buffers, batch.addresses):
+            self.sendto(buffer, address)
+        syscalls = 1 if batch.batched else len(batch)
+        batch.clear()
+        return syscalls
+
+    def close(self) -> None:
+        if self in self.network.sockets:
+            self.network.sockets.remove(self)
+
+
+class EmulatedHost(Transport):
+    """The view of an ``EmulatedNetwork`` from one host, to be passed to a ``Module``"""
+
+    def __init__(
+        self,
+        network: "EmulatedNetwork",
+        address: str,
+        broadcast: str,
+        clock_offset: float = 0.0,
+        clock_drift: float = 0.0,
+        extra_addresses: Iterable[str] = (),
+    ):
+        super().__init__(network.rng)
+        self.network = network
+        self.address = address
+        self.broadcast = broadcast
+        self.clock_offset = clock_offset
+        self.clock_drift = clock_drift
+        self.addresses = [address, *extra_addresses]
+
+    def interfaces(self) -> List[Dict[str, str]]:
+        return [
+            {
+                "addr": address,
+                "netmask": "255.255.255.0",
+                "broadcast": segment(address) + ".255",
+            }
+            for address in self.addresses
+        ]
+
+    def open(
+        self, address: str, port: Optional[int] = None, bind: str = ""
+    ) -> EmulatedSocket:
+        if port == 0:
+            port = next(self.network.ephemeral_ports)
+        sock = EmulatedSocket(self.network, address, port)
+        self.network.sockets.append(sock)
+        return sock
+
+    def time(self) -> float:
+        return self.network.now * (1 + self.clock_drift) + self.clock_offset
+
+    def wait_until(self, deadline: float) -> None:
+        # Only meaningful while a single module runs on the network, as nothing else is updated
+        # while the clock jumps ahead
+        now = (deadline - self.clock_offset) / (1 + self.clock_drift)
+        self.network.now = max(self.network.now, now)
+
+
+class EmulatedNetwork:
+    """A deterministic in-memory network with a virtual clock
+
+    :param seed: Seed of the random generator used for every impairment and by the modules
+
+    :param profile: Impairments of every link between two different hosts, unless overridden with
+        ``set_link``. Datagrams a host sends to itself are delivered immediately.
+    """
+
+    def __init__(self, seed: int = 0, profile: Optional[LinkProfile] = None):
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.profile = profile or LinkProfile()
+        self.links: Dict[Tuple[str, str], Link] = {}
+        self.sockets: List[EmulatedSocket] = []
+        self.order = itertools.count()
+        self.ephemeral_ports = itertools.count(49152)
+
+    def host(
+        self,
+        address: str,
+        clock_offset: float = 0.0,
+        clock_drift: float = 0.0,
+        extra_addresses: Iterable[str] = (),
+    ) -> EmulatedHost:
+        """Adds a host with an interface at ``address`` in a /24 network
+
+        :param clock_offset: Time in seconds that the host's clock reads when the network's reads 0
+
+        :param clock_drift: Rate error of the host's clock, for instance ``50e-6`` for a clock
+            running 50 ppm fast
+
+        :param extra_addresses: Addresses of further interfaces of the host, each with links of
+            its own. Interfaces in different /24 networks are on separate segments, which
+            multicast datagrams do not cross.
+        """
+        broadcast = segment(address) + ".255"
+        return EmulatedHost(
+            self, address, broadcast, clock_offset, clock_drift, extra_addresses
+        )
+
+    def set_link(self, source: str, destination: str, profile: LinkProfile) -> None:
+        """Sets the impairments of datagrams sent from ``source`` to ``destination``"""
+        self.link(source, destination).profile = profile
+
+    def link(self, source: str, destination: str) -> Link:
+        if (source, destination) not in self.links:
+            profile = LinkProfile() if source == destination else self.profile
+            self.links[(source, destination)] = Link(profile)
+        return self.links[(source, destination)]
+
+    def stats(self) -> LinkStats:
+        """Totals of the counters of every link"""
+        total = LinkStats()
+        for link in self.links.values():
+            for name, value in vars(link.stats).items():
+                setattr(total, name, getattr(total, name) + value)
+        return total
+
+    def advance(self, seconds: float) -> None:
+        """Moves the virtual clock forward"""
+        self.now += seconds
+
+    def run(
+        self, modules: Iterable, seconds: float, step: float = 0.5 / PACKET_RATE
+    ) -> None:
+        """Updates every module in turn while moving the clock forward by ``step`` at a time"""
+        modules = list(modules)
+        end = self.now + seconds
+        while self.now < end:
+            for module in modules:
+                module.update()
+            self.advance(step)
+
+    def send(self, source: str, data: bytes, address: Tuple[str, int]) -> None:
+        """Delivers a datagram to every socket bound to the destination port that either has
+        the destination address or has joined it as a multicast group on the sender's segment
+        """
+        group, port = address
+        multicast = 224 <= int(group.split(".", 1)[0]) <= 239
+        for sock in self.sockets:
+            if sock.port != port:
+                continue
+            if multicast:
+                delivered = group in sock.groups
+                delivered = delivered and sock.sources.get(group, source) == source
+                delivered = delivered and segment(sock.address) == segment(source)
+            else:
+                delivered = group == sock.address
+            if delivered:
+                self.transmit(self.link(source, sock.address), sock, data)
+
+    def transmit(self, link: Link, sock: EmulatedSocket, data: bytes) -> None:
+        profile, stats = link.profile, link.stats
+        stats.sent += 1
+        if profile.loss and self.rng.random() < profile.loss:
+            stats.lost += 1
+            return
+        departure = self.now
+        if profile.bandwidth is not None:
+            departure = max(departure, link.busy_until)
+            if departure - self.now > profile.queue_limit:
+                stats.dropped += 1
+                return
+            departure += len(data) * 8 / profile.bandwidth
+            link.busy_until = departure
+        arrival = departure + profile.latency
+        if profile.jitter:
+            arrival += self.rng.uniform(0, profile.jitter)
+        if profile.reorder and self.rng.random() < profile.reorder:
+            arrival += profile.reorder_delay
+            stats.reordered += 1
+        stats.delivered_bytes += len(data)
+        heapq.heappush(sock.queue, (arrival, next(self.order), bytes(data)))
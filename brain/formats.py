@@ -0,0 +1,124 @@
+# Samples travel between jacks in the sample format of the sending module, and a receiving input
+# jack only converts them if its own module processes a different format. Each format has an
+# in-memory numpy type (24-bit samples are held in 32-bit integers) and a scale, so that full
+# scale in one format maps to full scale in another.
+
+import numpy as np
+
+from typing import Dict, Final
+
+from .constants import CHANNELS
+from .protocol import SampleFormat
+
+#: Numpy type holding the samples of each format in memory
+SAMPLE_DTYPES: Final[Dict[SampleFormat, type]] = {
+    SampleFormat.INT16: np.int16,
+    SampleFormat.INT24: np.int32,
+    SampleFormat.FLOAT32: np.float32,
+}
+
+#: Number of bytes used by each sample in a datagram
+SAMPLE_WIDTHS: Final[Dict[SampleFormat, int]] = {
+    SampleFormat.INT16: 2,
+    SampleFormat.INT24: 3,
+    SampleFormat.FLOAT32: 4,
+}
+
+#: Magnitude of a full-scale sample
+FULL_SCALE: Final[Dict[SampleFormat, float]] = {
+    SampleFormat.INT16: 2**15,
+    SampleFormat.INT24: 2**23,
+    SampleFormat.FLOAT32: 1.0,
+}
+
+
+def wire_view(frames: np.ndarray, sample_format: SampleFormat, block_size: int):
+    """Views the payload bytes of one or more frames as blocks of samples. Packed 24-bit samples
+    are viewed as bytes with a trailing axis of three.
+
+    :param frames: Array of bytes with the payload of one frame in its last axis
+    """
+    shape = frames.shape[:-1] + (block_size, CHANNELS)
+    if sample_format == SampleFormat.INT24:
+        return frames.reshape(shape + (3,))
+    return frames.view(SAMPLE_DTYPES[sample_format]).reshape(shape)
+
+
+class SampleEncoder:
+    """Writes blocks of samples held in memory into views returned by ``wire_view``. Packed
+    24-bit samples go through a preallocated little-endian block, from which the low three bytes
+    of each sample are copied.
+
+    :param sample_format: Format of the samples, in memory and on the wire
+
+    :param block_size: Number of samples per channel in each block
+    """
+
+    def __init__(self, sample_format: SampleFormat, block_size: int):
+        self.sample_format = sample_format
+        if sample_format == SampleFormat.INT24:
+            shape = (block_size, CHANNELS)
+            self.packed = np.zeros(shape, dtype="<i4")
+            self.low_bytes = self.packed.view(np.uint8).reshape(shape + (4,))[..., :3]
+
+    def encode(self, data: np.ndarray, wire: np.ndarray) -> None:
+        """Writes a block of shape (``block_size``, ``CHANNELS``), of any integer type for
+        packed 24-bit samples
+        """
+        if self.sample_format == SampleFormat.INT24:
+            np.copyto(self.packed, data, casting="unsafe")
+            wire[...] = self.low_bytes
+        else:
+            wire[...] = data
+
+
+class SampleConverter:
+    """Reads blocks of a stream in one sample format into preallocated blocks of another
+
+    :param source: Format of the stream
+
+    :param target: Format that the blocks are returned in
+
+    :param block_size: Number of samples per channel in each block
+    """
+
+    def __init__(self, source: SampleFormat, target: SampleFormat, block_size: int):
+        self.source = source
+        self.target = target
+        self.scale = FULL_SCALE[target] / FULL_SCALE[source]
+        shape = (block_size, CHANNELS)
+        self.block = np.zeros(shape, dtype=SAMPLE_DTYPES[target])
+        if source == SampleFormat.INT24:
+            self.unpacked = np.zeros(shape, dtype=np.int32)
+            self.unpacked_bytes = self.unpacked.view(np.uint8).reshape(shape + (4,))
+        if source == SampleFormat.FLOAT32 and target != SampleFormat.FLOAT32:
+            self.scaled = np.zeros(shape, dtype=np.float32)
+
+    def convert(self, wire: np.ndarray) -> np.ndarray:
+        """Converts a block viewed by ``wire_view``
+
+        :return: The converted block, which is overwritten by the next conversion
+        """
+        data = wire
+        if self.source == SampleFormat.INT24:
+            # Place the three bytes at the top of a 32-bit sample and shift back down, which sign
+            # extends them
+            self.unpacked_bytes[..., 1:] = wire
+            np.right_shift(self.unpacked, 8, out=self.unpacked)
+            if self.target == SampleFormat.INT24:
+                return self.unpacked
+            data = self.unpacked
+
+        if self.target == SampleFormat.FLOAT32:
+            np.multiply(data, self.scale, out=self.block)
+        elif self.source == SampleFormat.FLOAT32:
+            limit = FULL_SCALE[self.target]
+            np.multiply(data, self.scale, out=self.scaled)
+            np.rint(self.scaled, out=self.scaled)
+            np.clip(self.scaled, -limit, limit - 1, out=self.scaled)
+            np.copyto(self.block, self.scaled, casting="unsafe")
+        elif self.scale > 1:
+            np.left_shift(data, 8, out=self.block, dtype=np.int32)
+        else:
+            np.right_shift(data, 8, out=self.block, casting="unsafe")
+        return self.block
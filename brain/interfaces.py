@@ -17,10 +17,12 @@ class EventHandler:
     def process(self, input: np.ndarray) -> np.ndarray:
         """Process all incoming data as a single block
 
-        :param input: An array of shape (X, ``BLOCK_SIZE``, ``CHANNELS``) of data type
-            ``SAMPLE_TYPE``, where X is the number of added input jacks in the order created.
+        :param input: An array of shape (X, ``block_size``, ``CHANNELS``) of the module's sample
+            type (``SAMPLE_TYPE`` unless the module was given another ``sample_format``), where X
+            is the number of added input jacks in the order created and ``block_size`` is the
+            module's block size (``BLOCK_SIZE`` by default).
 
-        :return: An array of shape (X, ``BLOCK_SIZE``, ``CHANNELS``) of data type ``SAMPLE_TYPE``,
+        :return: An array of shape (X, ``block_size``, ``CHANNELS``) of the module's sample type,
             where X is the number of added output jacks in the order created.
         """
         return np.zeros((0, BLOCK_SIZE, CHANNELS), dtype=SAMPLE_TYPE)
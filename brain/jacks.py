@@ -1,12 +1,45 @@
 import itertools
 import logging
 import numpy as np
+import weakref
 
 from collections import deque
-from typing import Final, Set, Tuple
-
-from .constants import BLOCK_SIZE, CHANNELS, SAMPLE_TYPE
-from .servers import InputJackListener, OutputJackServer
+from typing import Deque, Dict, Final, List, Optional, Set, Tuple
+
+from .buffers import JitterBuffer
+from .codec import RiceCodec
+from .concealment import Concealer, Concealment
+from .constants import (
+    BLOCK_SIZE,
+    CHANNELS,
+    JACK_KEEPALIVE_INTERVAL,
+    JACK_RING_SIZE,
+    JITTER_TARGET_DEPTH,
+    SAMPLE_RATE,
+)
+from .formats import (
+    FULL_SCALE,
+    SAMPLE_DTYPES,
+    SAMPLE_WIDTHS,
+    SampleConverter,
+    SampleEncoder,
+    wire_view,
+)
+from .parsers import BlockParser
+from .protocol import SampleFormat
+from .resampler import Resampler
+from .servers import UDP_OVERHEAD, InputJackListener, OutputJackServer
+from .shm import SharedBlockReader, SharedBlockWriter
+from .stats import JackStats
+
+# Jacks of every module in this interpreter, keyed by module uuid and jack id. A patch between two
+# of them hands the blocks over directly instead of going through shared memory or the network.
+local_inputs: "weakref.WeakValueDictionary[Tuple[str, int], InputJack]" = (
+    weakref.WeakValueDictionary()
+)
+local_outputs: "weakref.WeakValueDictionary[Tuple[str, int], OutputJack]" = (
+    weakref.WeakValueDictionary()
+)
 
 
 class Jack:
@@ -27,23 +60,128 @@ class Jack:
     def get_level(self) -> float:
         raise NotImplementedError
 
+    def get_stats(self) -> JackStats:
+        raise NotImplementedError
+
+
+def level_scale(sample_format: SampleFormat) -> float:
+    """Sample magnitude shown as a full level on a jack"""
+    return 8000 / FULL_SCALE[SampleFormat.INT16] * FULL_SCALE[sample_format]
+
 
 class InputJack(Jack):
     """An input jack which receives data from an output jack over the network. This is not
     typically instantiated directly but rather through ``Module.add_input``.
 
     :param name: Identifier describing the input jack
+
+    :param jack_listener: The module's listener that receives and routes data for all its jacks,
+        or ``None`` on a host without network interfaces
+
+    :param target_depth: Number of blocks to buffer before playing out data, which is adapted to
+        the measured network jitter while running
+
+    :param block_size: Number of samples per channel in the blocks returned by ``get_data``.
+        Streams with a different block size are cut up or joined together to match.
+
+    :param sample_format: Format of the samples returned by ``get_data``. Streams in another
+        format are converted.
+
+    :param resample: Read the stream through a resampler steered to hold the jitter buffer at its
+        target depth, for streams from a module whose clock is not locked to this one
+
+    :param concealment: How blocks missing from the stream are filled in
     """
 
-    def __init__(self, name: str):
-        self.data_queue = deque()
-        self.last_seen_data = np.zeros((BLOCK_SIZE, CHANNELS), dtype=SAMPLE_TYPE)
+    def __init__(
+        self,
+        name: str,
+        jack_listener: Optional[InputJackListener],
+        target_depth: int = JITTER_TARGET_DEPTH,
+        block_size: int = BLOCK_SIZE,
+        sample_format: SampleFormat = SampleFormat.INT16,
+        resample: bool = False,
+        concealment: Concealment = Concealment.HOLD,
+    ):
+        self.block_size = block_size
+        self.sample_format = sample_format
+        self.resample = resample
+        self.concealment = concealment
+        self.stats = JackStats()
+        self.create_buffer(target_depth, block_size, sample_format)
+        self.block = np.zeros(
+            (block_size, CHANNELS), dtype=SAMPLE_DTYPES[sample_format]
+        )
+        self.last_seen_data = self.block
         self.connected_jack_uuid = None
         self.connected_jack_id = None
-        self.jack_listener = InputJackListener()
+        self.connected_addr = None
+        self.connected_stream: Optional[int] = None
+        self.fec: Optional[int] = None
+        self.jack_listener = jack_listener
+        # Listener that the current stream is received on, which depends on the interface the
+        # output sends from
+        self.listener = jack_listener
+        self.shared_reader: Optional[SharedBlockReader] = None
+        self.direct = False
+        #: Set when the output is on the same host but its shared memory could not be attached to,
+        #: so the stream is received from the network instead
+        self.shm_missing = False
+        self.mailbox: Deque[Tuple[int, int, np.ndarray]] = deque(maxlen=JACK_RING_SIZE)
 
         super().__init__(name)
 
+    def create_buffer(
+        self, target_depth: int, block_size: int, sample_format: SampleFormat
+    ) -> None:
+        """Allocates the jitter buffer for a stream with the given block size and format"""
+        self.parser = BlockParser(block_size, sample_format)
+        self.buffer = JitterBuffer(
+            target_depth,
+            header_size=self.parser.header.size,
+            stats=self.stats,
+            block_size=block_size,
+            sample_format=sample_format,
+        )
+        # Writes blocks handed over directly into the jitter buffer
+        self.encoder = SampleEncoder(sample_format, block_size)
+        self.converter: Optional[SampleConverter] = None
+        if sample_format != self.sample_format or sample_format == SampleFormat.INT24:
+            self.converter = SampleConverter(
+                sample_format, self.sample_format, block_size
+            )
+        # Remainder of the last stream block not yet returned when re-blocking
+        self.chunk = self.buffer.last()
+        self.chunk_offset = block_size
+        self.concealer = Concealer(
+            self.concealment, block_size, SAMPLE_DTYPES[self.sample_format]
+        )
+        # Created once the stream turns out to be compressed
+        self.codec: Optional[RiceCodec] = None
+        # Parity, compressed and constant frames are copied here to be read as arrays
+        header_size = self.parser.header.size
+        self.frame = np.zeros(header_size + self.parser.payload_size, dtype=np.uint8)
+        self.frame_view = memoryview(self.frame)
+        self.frame_payload = self.frame[header_size:]
+        # Value of each channel in a constant frame, once copied into ``frame``
+        width = SAMPLE_WIDTHS[sample_format]
+        self.frame_values = wire_view(
+            self.frame_payload[: CHANNELS * width], sample_format, 1
+        )
+        self.coded_start = self.parser.header.size + self.parser.length.size
+        self.reset_resampler()
+
+    def reset_resampler(self) -> None:
+        """Starts resampling a new stream from the nominal rate"""
+        self.resampler: Optional[Resampler] = None
+        if self.resample:
+            self.resampler = Resampler(
+                self.block_size,
+                self.parser.block_size,
+                SAMPLE_DTYPES[self.sample_format],
+            )
+            self.stats.rate_ratio = self.resampler.ratio
+
     def is_patched(self) -> bool:
         """Check if input jack is currently connected to a patch
 
@@ -53,9 +191,19 @@ class InputJack(Jack):
 
     def clear(self):
         if self.is_patched():
-            self.jack_listener.disconnect()
+            if self.direct:
+                self.direct = False
+                self.mailbox.clear()
+            elif self.shared_reader is not None:
+                self.shared_reader.close()
+                self.shared_reader = None
+            else:
+                self.listener.unsubscribe(
+                    self.connected_addr, self.receive, self.connected_stream
+                )
             self.connected_jack_uuid = None
             self.connected_jack_id = None
+            self.connected_addr = None
 
     def disconnect(self, output_uuid, output_id):
         if self.is_connected(output_uuid, output_id):
@@ -67,34 +215,192 @@ class InputJack(Jack):
             output_id,
         )
 
-    def connect(self, address, mult_addr, port, output_color, output_uuid, output_id):
+    def connect(
+        self,
+        mult_addr,
+        port,
+        output_color,
+        output_uuid,
+        output_id,
+        shm=None,
+        stream=None,
+        block_size=BLOCK_SIZE,
+        sample_format=SampleFormat.INT16,
+        fec=None,
+        listener=None,
+        source=None,
+    ):
+        """Starts receiving from an output jack. An output in this interpreter hands its blocks
+        over directly, one on the same host writes them to the shared memory segment named ``shm``
+        and any other is received from its multicast group. ``stream`` is the output's stream id
+        if it differs from the one derived from the group, as for bundled outputs,
+        ``block_size`` and ``sample_format`` describe the stream's blocks and ``fec`` is the
+        number of blocks covered by each parity frame if the output sends them. Streams from the
+        network are received on ``listener``, by default the jack's own listener, and only from
+        ``source`` if it is given.
+        """
         if self.is_patched():
             self.clear()
         self.color = output_color
         self.connected_jack_uuid = output_uuid
-        self.connect_jack_id = output_id
+        self.connected_jack_id = output_id
+        self.connected_addr = mult_addr
+        self.connected_stream = stream
+        self.fec = fec
+        self.shm_missing = False
+        if (block_size, sample_format) != (
+            self.parser.block_size,
+            self.parser.sample_format,
+        ):
+            self.create_buffer(self.buffer.target_depth, block_size, sample_format)
+        else:
+            self.buffer.reset()
+            self.chunk_offset = block_size
+            self.reset_resampler()
+
+        if (output_uuid, output_id) in local_outputs:
+            self.direct = True
+            return
+        if shm is not None:
+            try:
+                self.shared_reader = SharedBlockReader(shm, len(self.buffer.slots[0]))
+                return
+            except FileNotFoundError:
+                logging.warning(
+                    f"Shared memory {shm} not found, falling back to network"
+                )
+                self.shm_missing = True
+        self.listener = listener or self.jack_listener
+        self.listener.subscribe(mult_addr, port, self.receive, stream, source)
+
+    def update(self) -> None:
+        """Reads any blocks handed over directly or published through shared memory since the
+        last update
+        """
+        if self.mailbox:
+            arrival = self.jack_listener.transport.time()
+            while self.mailbox:
+                sequence, timestamp, data = self.mailbox.popleft()
+                self.encoder.encode(data, self.buffer.write_block())
+                self.buffer.insert(sequence, timestamp, arrival)
+        if self.shared_reader is not None:
+            self.shared_reader.poll(self.receive_shared)
+
+    def receive_shared(self, frame: memoryview, nbytes: int) -> None:
+        self.receive(frame, nbytes, self.jack_listener.transport.time())
+
+    def receive(self, frame: memoryview, nbytes: int, arrival: float) -> None:
+        """Called by the listener with a datagram routed to this jack, which is validated and
+        copied into the jitter buffer, or decompressed into it, along with any parity frames.
+        """
+        header = self.parser.parse_header(frame, nbytes)
+        if header is None:
+            self.stats.rejected += 1
+            return
+        sequence, timestamp, flags = header
+        if flags & self.parser.parity_flag:
+            self.stats.parity += 1
+            if self.fec is not None:
+                self.frame_view[:nbytes] = frame[:nbytes]
+                self.buffer.insert_parity(self.frame_payload, sequence, self.fec)
+        elif flags & self.parser.compressed_flag:
+            if self.codec is None:
+                self.codec = RiceCodec(
+                    self.parser.block_size, self.parser.sample_format, self.stats
+                )
+            if nbytes > len(self.frame):
+                self.stats.rejected += 1
+                return
+            self.frame_view[:nbytes] = frame[:nbytes]
+            start = self.coded_start
+            payload = self.frame[start:nbytes]
+            if not self.codec.decode(payload, self.buffer.write_block()):
+                self.stats.rejected += 1
+                return
+            self.buffer.insert(sequence, timestamp, arrival)
+        elif flags & (self.parser.constant_flag | self.parser.repeat_flag):
+            if self.expand(frame, nbytes, sequence, flags):
+                self.buffer.insert(sequence, timestamp, arrival)
+        else:
+            if self.codec is not None:
+                self.codec.record_raw()
+            self.buffer.write_slot()[:nbytes] = frame[:nbytes]
+            self.buffer.insert(sequence, timestamp, arrival)
 
-        self.jack_listener.connect(address, mult_addr, port)
+    def expand(self, frame: memoryview, nbytes: int, sequence: int, flags: int) -> bool:
+        """Fills the jitter buffer's free slot from a compact frame, either with the value of each
+        channel or with the previous block of the stream
 
-    def update(self):
-        if len(data := self.jack_listener.get_data()) != 0:
-            data = np.frombuffer(data, dtype=SAMPLE_TYPE)
-            data = data.reshape((len(data) // CHANNELS, CHANNELS))
-            self.last_seen_data = data.copy()
-            self.data_queue.appendleft(data)
-            return True
-        return False
+        :return: ``False`` if the block repeats one that is not in the buffer, which is then
+            treated as lost
+        """
+        block = self.buffer.write_block()
+        if flags & self.parser.constant_flag:
+            self.frame_view[:nbytes] = frame[:nbytes]
+            block[...] = self.frame_values
+        else:
+            previous = self.buffer.held((sequence - 1) & 0xFFFFFFFF)
+            if previous is None:
+                return False
+            np.copyto(block, previous)
+        self.stats.compact += 1
+        return True
 
     def get_data(self) -> np.ndarray:
-        """Pull pending data from the jack. In the event that data is not available, this will
-        return a copy of the last seen packet.
+        """Pull the next block of data from the jack's jitter buffer. In the event that data is not
+        available, this will return the last seen packet again. The returned array is a view into
+        the jack's receive buffer and is only valid until the listener next receives data, so it
+        should be copied if kept.
 
-        :return: An array of shape (``BLOCK_SIZE``, ``CHANNELS``) of data type ``SAMPLE_TYPE``
+        :return: An array of shape (``block_size``, ``CHANNELS``) in the jack's sample format
         """
-        if len(self.data_queue) > 0:
-            return self.data_queue.pop()
-        else:
-            return self.last_seen_data.copy()
+        if self.resampler is not None:
+            error = None
+            if self.buffer.playing:
+                # The part of the next block already on its way and the part of the current one
+                # not yet played each add half a block on average to the depth the buffer holds
+                # without resampling
+                now = self.jack_listener.transport.time()
+                depth = self.buffer.fill(now) + self.resampler.pending() - 1
+                error = depth - self.buffer.target_depth
+            self.last_seen_data = self.resampler.read(self.next_block, error)
+            self.stats.rate_ratio = self.resampler.ratio
+            return self.last_seen_data
+
+        if self.parser.block_size == self.block_size:
+            self.last_seen_data = self.next_block()
+            return self.last_seen_data
+
+        # The stream's blocks are cut up or joined together into blocks of this jack's size
+        filled = 0
+        while filled < self.block_size:
+            if self.chunk_offset == len(self.chunk):
+                self.chunk = self.next_block()
+                self.chunk_offset = 0
+            start = self.chunk_offset
+            count = min(self.block_size - filled, len(self.chunk) - start)
+            stop, end = start + count, filled + count
+            self.block[filled:end] = self.chunk[start:stop]
+            self.chunk_offset, filled = stop, end
+        self.last_seen_data = self.block
+        return self.block
+
+    def next_block(self) -> np.ndarray:
+        """Plays out the next block of the stream converted to the jack's sample format, or a
+        block made up by the jack's concealment if it is not available
+        """
+        data = self.buffer.pop()
+        missing = data is None
+        if missing:
+            data = self.buffer.last()
+        if self.converter is not None:
+            data = self.converter.convert(data)
+        if missing:
+            if self.is_patched():
+                self.stats.concealed += 1
+            return self.concealer.conceal(data)
+        self.concealer.played(data)
+        return data
 
     def get_color(self) -> int:
         if not self.is_patched():
@@ -106,41 +412,317 @@ class InputJack(Jack):
         if not self.is_patched():
             return 0
         else:
-            return np.clip(np.amax(self.last_seen_data) / 8000, 0, 1)
+            level = np.amax(self.last_seen_data) / level_scale(self.sample_format)
+            return np.clip(level, 0, 1)
+
+    def get_stats(self) -> JackStats:
+        return self.stats
 
 
 class OutputJack(Jack):
     """An output jack which sends data to input jacks over the network. This is not
     typically instantiated directly but rather through ``Module.add_output``.
 
-    :param address: Local ip4 address to use multicast
+    :param jack_server: The module's server that sends data for all its output jacks
 
     :param name: Identifier describing the output jack
 
     :param color: An HSV Hue value for the jack's primary color in [0, 360). This color is
         propagated to any input jacks that it is patched to.
+
+    :param always_send: Send every block even when no input jacks are connected, for instance to
+        feed a monitoring tap. Otherwise an unpatched jack only sends a keepalive block every
+        ``JACK_KEEPALIVE_INTERVAL`` blocks.
+
+    :param block_size: Number of samples per channel in each block sent, which also sets the
+        packet rate of the stream
+
+    :param sample_format: Format of the samples given to ``send``, which are sent as they are
+
+    :param fec: Number of consecutive blocks covered by each parity frame sent to the network, so
+        that input jacks can rebuild one lost block per group, or ``None`` to send no parity
+
+    :param compress: Compress the blocks sent to the network with ``RiceCodec``, which only
+        applies to integer sample formats
+
+    :param compact: Send blocks that hold the same value throughout each channel, or repeat the
+        previous block, to the network as compact frames
+
+    :param unicast_limit: Largest number of modules on other hosts that the jack sends to by
+        unicast, one datagram each, rather than to its multicast group. ``0`` always multicasts.
     """
 
-    def __init__(self, address: str, name: str, color: int):
+    #: Largest number of compact frames sent in a row before a block is sent in full
+    compact_refresh: Final = 20
+
+    def __init__(
+        self,
+        jack_server: OutputJackServer,
+        name: str,
+        color: int,
+        always_send: bool = False,
+        block_size: int = BLOCK_SIZE,
+        sample_format: SampleFormat = SampleFormat.INT16,
+        fec: Optional[int] = None,
+        compress: bool = False,
+        compact: bool = False,
+        unicast_limit: int = 0,
+    ):
         self.color = color
+        self.always_send = always_send
+        self.blocks_since_sent = 0
         self.connected_jacks: Set[Tuple[str, int]] = set()
-        self.jack_server = OutputJackServer(address)
-        self.endpoint = self.jack_server.endpoint
+        self.local_jacks: Set[Tuple[str, int]] = set()
+        self.direct_jacks: Dict[Tuple[str, int], InputJack] = {}
+        # Unicast endpoint of the listener of each connected input jack on another host, where
+        # the input's module advertised one
+        self.unicast_endpoints: Dict[Tuple[str, int], Tuple[str, int]] = {}
+        self.unicast_limit = unicast_limit
+        self.jack_server = jack_server
+        self.endpoint = self.jack_server.allocate_endpoint()
+        #: Endpoints that each block sent to the network goes to
+        self.targets: List[Tuple[str, int]] = [self.endpoint]
         self.level = 0
+        self.stats = JackStats()
+
+        self.parser = BlockParser(block_size, sample_format)
+        self.stream = self.jack_server.allocate_stream(self.endpoint)
+        self.sequence = 0
+        self.frame = bytearray(self.parser.header.size + self.parser.payload_size)
+        self.frame_bytes = np.frombuffer(self.frame, dtype=np.uint8)
+        header_size = self.parser.header.size
+        self.frame_payload = self.frame_bytes[header_size:]
+        self.frame_data = wire_view(self.frame_payload, sample_format, block_size)
+        self.encoder = SampleEncoder(sample_format, block_size)
+        # XOR of the payloads sent so far in the current parity group, and the sequence number of
+        # the next block that continues it
+        self.fec = fec
+        self.parity_frame = bytearray(len(self.frame) if fec is not None else 0)
+        self.parity = np.frombuffer(self.parity_frame, dtype=np.uint8)[header_size:]
+        self.parity_next: Optional[int] = None
+        self.parity_timestamp = 0
+        # Frame that compressed blocks are encoded into, of which only the part in use is sent
+        self.codec: Optional[RiceCodec] = None
+        if compress:
+            self.codec = RiceCodec(block_size, sample_format, self.stats)
+            start = header_size + self.parser.length.size
+            self.coded_frame = bytearray(start + self.parser.payload_size)
+            self.coded_view = memoryview(self.coded_frame)
+            self.coded_payload = np.frombuffer(self.coded_frame, dtype=np.uint8)[start:]
+        # Frame for compact blocks, the last block sent to the network and the number of compact
+        # frames sent since the last full block
+        self.compact = compact
+        if compact:
+            width = SAMPLE_WIDTHS[sample_format]
+            self.compact_frame = bytearray(header_size + CHANNELS * width)
+            self.compact_view = memoryview(self.compact_frame)
+            self.compact_values = wire_view(
+                np.frombuffer(self.compact_frame, dtype=np.uint8)[header_size:],
+                sample_format,
+                1,
+            )
+            self.compact_encoder = SampleEncoder(sample_format, 1)
+            shape = (block_size, CHANNELS)
+            self.previous = np.zeros(shape, dtype=SAMPLE_DTYPES[sample_format])
+            self.previous_sequence: Optional[int] = None
+            self.same = np.zeros(shape, dtype=bool)
+            self.compact_run = 0
+        self.shared_writer: Optional[SharedBlockWriter] = None
+        if self.jack_server.transport.shortcuts:
+            self.shared_writer = SharedBlockWriter(len(self.frame))
 
         super().__init__(name)
 
-    def send(self, data: np.ndarray) -> None:
-        """Send data out through this jack. Caller is responsible for maintaining packet timing.
-        Currently, this sends data out to the network at all times.
+    def send(self, data: np.ndarray, timestamp: Optional[int] = None) -> None:
+        """Send data out through this jack. Caller is responsible for maintaining packet timing
+        and for calling ``flush`` on the jack server once all outputs for a block have been sent.
+        Blocks are only sent to the network while an input jack on another host is connected,
+        apart from a periodic keepalive, unless ``always_send`` is set. Input jacks on the same
+        host receive the blocks through shared memory instead, and input jacks in the same
+        interpreter are handed ``data`` itself, which must therefore not be modified afterwards.
+
+        :data: Data to be sent as an ndarray of shape (``block_size``, ``CHANNELS``)
 
-        :data: Data to be sent as an ndarray
+        :timestamp: Sample clock of the sending module at the start of the block. Defaults to
+            counting the blocks sent on this jack.
         """
         self.level = np.amax(data)
-        self.jack_server.datagram_send(data.tobytes())
-
-    def connect(self, input_uuid, input_id):
-        self.connected_jacks.add((input_uuid, input_id))
+        self.blocks_since_sent += 1
+        local = len(self.local_jacks) > 0
+        network = (
+            self.always_send
+            or len(self.connected_jacks)
+            > len(self.local_jacks) + len(self.direct_jacks)
+            or self.blocks_since_sent >= JACK_KEEPALIVE_INTERVAL
+        )
+        if not local and not network and not self.direct_jacks:
+            self.stats.suppressed += 1
+            return
+        if timestamp is None:
+            timestamp = self.sequence * self.parser.block_size
+        for input_jack in self.direct_jacks.values():
+            input_jack.mailbox.append((self.sequence, timestamp, data))
+        if local or network:
+            self.parser.create_header(self.frame, self.stream, self.sequence, timestamp)
+            self.encoder.encode(data, self.frame_data)
+            if local:
+                self.shared_writer.write(self.frame_bytes)
+            if network:
+                frame = None
+                if self.compact:
+                    frame = self.compact_block(data, timestamp)
+                if frame is None and self.codec is not None:
+                    frame = self.compress(data, timestamp)
+                if frame is None:
+                    frame = self.frame
+                for target in self.targets:
+                    self.jack_server.datagram_send(frame, target)
+                if self.targets[0] != self.endpoint:
+                    self.stats.unicast += len(self.targets)
+                self.blocks_since_sent = 0
+                if self.fec is not None:
+                    self.add_parity(timestamp)
+        self.sequence += 1
+        self.stats.sent += 1
+
+    def compress(self, data: np.ndarray, timestamp: int) -> memoryview:
+        """Encodes a block into the compressed frame
+
+        :return: The compressed frame, or the uncompressed one if the block does not compress
+        """
+        size = self.codec.encode(data, self.coded_payload)
+        if size is None:
+            return self.frame
+        self.parser.create_header(
+            self.coded_frame,
+            self.stream,
+            self.sequence,
+            timestamp,
+            self.parser.compressed_flag,
+        )
+        start = self.parser.header.size
+        self.parser.length.pack_into(self.coded_frame, start, size)
+        end = start + self.parser.length.size + size
+        return self.coded_view[:end]
+
+    def compact_block(self, data: np.ndarray, timestamp: int) -> Optional[memoryview]:
+        """Encodes a block that holds the same value throughout each channel, or that repeats the
+        previous block sent to the network, as a compact frame. After ``compact_refresh`` compact
+        frames in a row a block is sent in full, which bounds the run of repeats that an input
+        cannot expand after losing the block they repeat.
+
+        :return: The compact frame, or ``None`` if the block has to be sent in full
+        """
+        np.equal(data, data[0], out=self.same)
+        constant = bool(self.same.all())
+        repeat = False
+        if not constant and self.previous_sequence == self.sequence - 1:
+            np.equal(data, self.previous, out=self.same)
+            repeat = bool(self.same.all())
+        np.copyto(self.previous, data)
+        self.previous_sequence = self.sequence
+        if not (constant or repeat) or self.compact_run >= self.compact_refresh:
+            self.compact_run = 0
+            return None
+        self.compact_run += 1
+        self.stats.compact += 1
+        if repeat:
+            self.parser.create_header(
+                self.compact_frame,
+                self.stream,
+                self.sequence,
+                timestamp,
+                self.parser.repeat_flag,
+            )
+            return self.compact_view[: self.parser.header.size]
+        self.parser.create_header(
+            self.compact_frame,
+            self.stream,
+            self.sequence,
+            timestamp,
+            self.parser.constant_flag,
+        )
+        self.compact_encoder.encode(data[:1], self.compact_values)
+        return self.compact_view
+
+    def move(self, endpoint: Tuple[str, int]) -> None:
+        """Starts sending to another endpoint allocated by the jack server"""
+        if self.stream == self.jack_server.parser.stream_id(self.endpoint[0]):
+            self.stream = self.jack_server.parser.stream_id(endpoint[0])
+        self.endpoint = endpoint
+        self.update_targets()
+
+    def update_targets(self) -> None:
+        """Chooses between unicast and multicast delivery for the connected input jacks. Inputs
+        stay subscribed to the multicast group either way and frames are routed by stream id, so
+        switching from one to the other between two blocks loses nothing.
+        """
+        remote = self.connected_jacks - self.local_jacks - self.direct_jacks.keys()
+        endpoints = {self.unicast_endpoints.get(jack) for jack in remote}
+        self.targets = [self.endpoint]
+        if (
+            remote
+            and None not in endpoints
+            and len(endpoints) <= self.unicast_limit
+            and self.endpoint != self.jack_server.bundle_endpoint
+        ):
+            self.targets = sorted(endpoints)
+
+    def bit_rate(self) -> float:
+        """Bits per second that the jack sends to the network while patched, including IP and
+        UDP headers and parity
+        """
+        rate = SAMPLE_RATE / self.parser.block_size
+        if self.fec is not None:
+            rate *= 1 + 1 / self.fec
+        return (len(self.frame) + UDP_OVERHEAD) * 8 * rate
+
+    def add_parity(self, timestamp: int) -> None:
+        """Folds the block just sent into the parity of its group, and sends the parity once every
+        block of the group has been sent
+        """
+        payload = self.frame_payload
+        position = self.sequence % self.fec
+        if position == 0:
+            np.copyto(self.parity, payload)
+            self.parity_timestamp = timestamp
+        elif self.sequence == self.parity_next:
+            np.bitwise_xor(self.parity, payload, out=self.parity)
+        else:
+            return
+        self.parity_next = self.sequence + 1
+        if position == self.fec - 1:
+            first = self.sequence - position
+            self.parser.create_header(
+                self.parity_frame,
+                self.stream,
+                first,
+                self.parity_timestamp,
+                self.parser.parity_flag,
+            )
+            for target in self.targets:
+                self.jack_server.datagram_send(self.parity_frame, target)
+            self.stats.parity += 1
+
+    def connect(self, input_uuid, input_id, local=False, endpoint=None):
+        """Adds an input jack to send to. ``local`` indicates that the input is on the same host
+        and reads the blocks from shared memory, unless it is in this interpreter and is handed
+        the blocks directly. ``endpoint`` is where the input's module receives unicast streams.
+        """
+        key = (input_uuid, input_id)
+        self.connected_jacks.add(key)
+        # Connecting an input again replaces how it was reached before
+        self.local_jacks.discard(key)
+        self.direct_jacks.pop(key, None)
+        self.unicast_endpoints.pop(key, None)
+        input_jack = local_inputs.get(key)
+        if input_jack is not None:
+            self.direct_jacks[key] = input_jack
+        elif local and self.shared_writer is not None:
+            self.local_jacks.add(key)
+        elif endpoint is not None:
+            self.unicast_endpoints[key] = tuple(endpoint)
+        self.update_targets()
 
     def is_connected(self, input_uuid, input_id):
         logging.info("Connected output jack test:")
@@ -150,6 +732,10 @@ class OutputJack(Jack):
 
     def disconnect(self, input_uuid, input_id):
         self.connected_jacks.discard((input_uuid, input_id))
+        self.local_jacks.discard((input_uuid, input_id))
+        self.direct_jacks.pop((input_uuid, input_id), None)
+        self.unicast_endpoints.pop((input_uuid, input_id), None)
+        self.update_targets()
 
     def is_patched(self) -> bool:
         """Check if output jack is currently connected to a patch
@@ -160,9 +746,16 @@ class OutputJack(Jack):
 
     def clear(self):
         self.connected_jacks.clear()
+        self.local_jacks.clear()
+        self.direct_jacks.clear()
+        self.unicast_endpoints.clear()
+        self.update_targets()
 
     def get_color(self) -> int:
         return self.color
 
     def get_level(self) -> float:
-        return np.clip(self.level / 8000, 0, 1)
+        return np.clip(self.level / level_scale(self.parser.sample_format), 0, 1)
+
+    def get_stats(self) -> JackStats:
+        return self.stats
@@ -13,14 +13,19 @@
 #
 # This can be expanded to keep track of all current patch connections made in the future, if
 # required.
+#
+# The heartbeats also carry the timestamps that keep every module's network clock in step with the
+# leader's (see ``brain.clock``), and the multicast groups that the leader found more than one
+# module sending to, so that all but one of them move elsewhere.
 
 import logging
+import random
 
 from enum import Enum
-from random import randrange
-from time import perf_counter_ns
-from typing import Dict, Final, Optional
+from time import perf_counter
+from typing import Callable, Dict, Final, List, Optional, Tuple
 
+from brain.clock import NetworkClock
 from brain.protocol import (
     GlobalStateUpdate,
     LocalState,
@@ -48,9 +53,25 @@ class LeaderElection:
     heartbeat_interval: Final = 50  # ms
     response_timeout: Final = 50  # ms
 
-    def __init__(self, id, patch_server) -> None:
+    def __init__(
+        self,
+        id,
+        patch_server,
+        clock: Callable[[], float] = perf_counter,
+        rng: Optional[random.Random] = None,
+        network_clock: Optional[NetworkClock] = None,
+    ) -> None:
         self.id = id
         self.patch_server = patch_server
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.network_clock = network_clock or NetworkClock(clock)
+        # Timestamps of the last heartbeat answered as a follower, completed by the next heartbeat
+        self.exchange: Optional[Tuple[str, int, float, float, float]] = None
+        # Network time at which each response to the current heartbeat arrived, as the leader
+        self.response_times: Dict[str, float] = {}
+        # Groups sent to by several modules, as last found by the leader
+        self.collisions: Dict[str, List[str]] = {}
         self.seen_hosts: Dict[str, Optional[LocalState]] = {}
         self.local_state = LocalState(held_inputs=[], held_outputs=[])
         self.last_update = None
@@ -58,11 +79,11 @@ class LeaderElection:
         self.reset_election_timer()
 
     def time_ms(self):
-        return perf_counter_ns() // 1000000
+        return int(self.clock() * 1000)
 
     def reset_election_timer(self):
         self.election_time = self.time_ms()
-        self.election_timeout = randrange(*self.election_timeout_interval)
+        self.election_timeout = self.rng.randrange(*self.election_timeout_interval)
 
     def reset_heartbeat_timer(self):
         self.heartbeat_time = self.time_ms()
@@ -96,6 +117,8 @@ class LeaderElection:
                     self.role = Roles.FOLLOWER
                     self.voted_for = message.uuid
                 self.reset_election_timer()
+                self.collisions = message.collisions
+                received = self.synchronize(message)
                 self.patch_server.message_send(
                     HeartbeatResponse(
                         uuid=self.id,
@@ -105,6 +128,14 @@ class LeaderElection:
                         state=self.local_state,
                     )
                 )
+                if message.time is not None:
+                    self.exchange = (
+                        message.uuid,
+                        message.iteration,
+                        message.time,
+                        received,
+                        self.network_clock.time(),
+                    )
 
         if isinstance(message, RequestVote):
             if message.term < self.current_term:
@@ -169,6 +200,7 @@ class LeaderElection:
                     self.role = Roles.LEADER
                     self.iteration = 0
                     self.last_update = None
+                    self.response_times = {}
                 else:
                     self.role = Roles.FOLLOWER
 
@@ -180,6 +212,7 @@ class LeaderElection:
                 # as all known module have responded.
                 if self.last_seen_hosts != -1:
                     self.check_global_state_update()
+                self.collisions = self.find_collisions()
 
                 self.reset_heartbeat_timer()
                 self.last_seen_hosts = len(self.seen_hosts)
@@ -190,8 +223,12 @@ class LeaderElection:
                         uuid=self.id,
                         term=self.current_term,
                         iteration=self.iteration,
+                        time=self.network_clock.time(),
+                        response_times=self.response_times,
+                        collisions=self.collisions,
                     )
                 )
+                self.response_times = {}
             if message and isinstance(message, HeartbeatResponse):
                 if (
                     message.success
@@ -200,11 +237,25 @@ class LeaderElection:
                 ):
                     # A timeout value should be added here for modules that go offline
                     self.seen_hosts[message.uuid] = message.state
+                    self.response_times[message.uuid] = self.network_clock.time()
                     # If everyone known checked in, then send update
                     if len(self.seen_hosts) == self.last_seen_hosts:
                         self.check_global_state_update()
                         self.last_seen_hosts = -1
 
+    def synchronize(self, message: Heartbeat) -> float:
+        """Completes the previous exchange with the leader, if the heartbeat carries the time at
+        which our response to it arrived, and disciplines the network clock accordingly
+
+        :return: Network time at which the heartbeat was received
+        """
+        response_time = message.response_times.get(self.id)
+        if self.exchange is not None and response_time is not None:
+            leader, iteration, t1, t2, t3 = self.exchange
+            if leader == message.uuid and iteration == message.iteration - 1:
+                self.network_clock.measure(t1, t2, t3, response_time)
+        return self.network_clock.time()
+
     def check_global_state_update(self):
         inputs = []
         outputs = []
@@ -233,5 +284,18 @@ class LeaderElection:
             logging.info("Sending global update: " + str(update))
             self.patch_server.message_send(update)
 
+    def find_collisions(self) -> Dict[str, List[str]]:
+        """Finds the multicast groups that more than one of the modules seen during the last
+        heartbeat send to
+        """
+        senders: Dict[str, List[str]] = {}
+        for uuid, state in self.seen_hosts.items():
+            if state is not None:
+                for group in state.groups:
+                    senders.setdefault(group, []).append(uuid)
+        return {
+            group: sorted(uuids) for group, uuids in senders.items() if len(uuids) > 1
+        }
+
     def update_local_state(self, local_state):
         self.local_state = local_state
@@ -0,0 +1,147 @@
+# Python's socket module has no binding for sendmmsg, which lets a batch of datagrams to different
+# destinations go out with a single system call. On Linux it is called directly through ctypes,
+# and everywhere else ``MessageBatch.send`` falls back to one sendto per datagram.
+
+import ctypes
+import ctypes.util
+import os
+import socket
+import sys
+
+from typing import Dict, List, Tuple
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+
+class _sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+
+def _load_sendmmsg():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [
+        ctypes.c_int,
+        ctypes.POINTER(_mmsghdr),
+        ctypes.c_uint,
+        ctypes.c_int,
+    ]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = _load_sendmmsg()
+
+
+class MessageBatch:
+    """A batch of datagrams to be sent together on one socket. The message headers are
+    preallocated, so adding a datagram only records a pointer to its (persistent) buffer.
+
+    :param capacity: Maximum number of datagrams in a batch
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.count = 0
+        self.buffers: List[bytearray] = []
+        self.addresses: List[Tuple[str, int]] = []
+        self.batched = _sendmmsg is not None
+        if self.batched:
+            self.sockaddrs: Dict[Tuple[str, int], _sockaddr_in] = {}
+            self.iovecs = (_iovec * capacity)()
+            self.headers = (_mmsghdr * capacity)()
+            for i in range(capacity):
+                self.headers[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+                self.headers[i].msg_hdr.msg_iovlen = 1
+
+    def __len__(self) -> int:
+        return self.count
+
+    def is_full(self) -> bool:
+        return self.count == self.capacity
+
+    def add(self, buffer: bytearray, address: Tuple[str, int]) -> None:
+        """Appends a datagram to the batch. ``buffer`` must not be modified until the batch is
+        sent.
+        """
+        assert not self.is_full()
+        self.buffers.append(buffer)
+        self.addresses.append(address)
+        if self.batched:
+            if address not in self.sockaddrs:
+                sockaddr = _sockaddr_in(socket.AF_INET, socket.htons(address[1]))
+                sockaddr.sin_addr[:] = socket.inet_aton(address[0])
+                self.sockaddrs[address] = sockaddr
+            sockaddr = self.sockaddrs[address]
+            self.iovecs[self.count].iov_base = ctypes.addressof(
+                ctypes.c_char.from_buffer(buffer)
+            )
+            self.iovecs[self.count].iov_len = len(buffer)
+            header = self.headers[self.count].msg_hdr
+            header.msg_name = ctypes.addressof(sockaddr)
+            header.msg_namelen = ctypes.sizeof(sockaddr)
+        self.count += 1
+
+    def send(self, sock: socket.socket) -> int:
+        """Sends every datagram in the batch and empties it.
+
+        :return: The number of system calls used
+        """
+        syscalls = 0
+        if self.batched:
+            sent = 0
+            while sent < self.count:
+                result = _sendmmsg(
+                    sock.fileno(),
+                    ctypes.cast(
+                        ctypes.byref(self.headers, sent * ctypes.sizeof(_mmsghdr)),
+                        ctypes.POINTER(_mmsghdr),
+                    ),
+                    self.count - sent,
+                    0,
+                )
+                syscalls += 1
+                if result < 0:
+                    errno = ctypes.get_errno()
+                    self.clear()
+                    raise OSError(errno, os.strerror(errno))
+                sent += result
+        else:
+            for buffer, address in zip(self.buffers, self.addresses):
+                sock.sendto(buffer, address)
+                syscalls += 1
+        self.clear()
+        return syscalls
+
+    def clear(self) -> None:
+        self.count = 0
+        self.buffers.clear()
+        self.addresses.clear()
@@ -1,27 +1,37 @@
+import ipaddress
 import logging
-import netifaces
 import numpy as np
-import time
 import uuid
 
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from collections import defaultdict
 
+from brain.clock import NetworkClock
 from brain.leader_election import LeaderElection
 
 from .constants import (
     BLOCK_SIZE,
     CHANNELS,
-    PACKET_RATE,
+    JITTER_TARGET_DEPTH,
     PREFERRED_BROADCAST,
-    SAMPLE_TYPE,
+    SAMPLE_RATE,
 )
+from .formats import SAMPLE_DTYPES
 from .interfaces import (
     EventHandler,
     PatchState,
 )
-from .jacks import Jack, InputJack, OutputJack
-from .servers import PatchServer
+from .concealment import Concealment
+from .jacks import Jack, InputJack, OutputJack, local_inputs, local_outputs
+from .servers import (
+    InputJackListener,
+    OutputJackServer,
+    PatchServer,
+    is_source_specific,
+)
+from .shm import HOST_ID
+from .stats import ClockStats, JackStats, SchedulerStats, SenderStats
+from .transport import Transport, UdpTransport
 from .protocol import (
     Directive,
     GlobalStateUpdate,
@@ -30,6 +40,7 @@ from .protocol import (
     HeldInputJack,
     HeldOutputJack,
     LocalState,
+    SampleFormat,
     RequestVote,
     RequestVoteResponse,
     Halt,
@@ -42,6 +53,12 @@ from .protocol import (
 )
 
 
+def interface_network(detail: Dict[str, str]) -> ipaddress.IPv4Network:
+    """The network of an interface listed by ``Transport.interfaces``"""
+    netmask = detail.get("netmask", "255.255.255.255")
+    return ipaddress.IPv4Network(f"{detail['addr']}/{netmask}", strict=False)
+
+
 class Module:
     """The ``Module`` object mediates all of the patching and dataflow between all other modules on
     the network. Typically, a module only needs to be written as a processor on the input state to
@@ -59,6 +76,39 @@ class Module:
         ``"group:product:instance_number"``, but anything that is globally unique works as well. In
         the physical world, this is unique for each module and is used to identify a specific one in
         the case of saving and restoring presets.
+
+    :param transport: Network that the module communicates over. By default this uses UDP on the
+        host's interfaces, but an emulated network from ``brain.emulator`` can be given instead.
+
+    :param bundle_mtu: Opts in to sending the blocks of all output jacks bundled into as few
+        datagrams as fit in this MTU (for instance 9000 with jumbo frames), rather than one
+        datagram per jack
+
+    :param block_size: Number of samples per channel processed and sent in each block, which must
+        divide ``SAMPLE_RATE``. Larger blocks lower the packet rate at the cost of latency, for
+        instance 192 samples at 250 packets per second on a congested network. Streams from
+        modules with a different block size are re-blocked by the receiving input jacks.
+
+    :param jack_interfaces: Addresses of further local interfaces to spread the module's jacks
+        across, for modules with more jacks than one link can carry. Each output jack is sent
+        from the interface with the least bandwidth committed so far, and each input jack
+        receives on the interface on the same network as the output it is patched to. Patching
+        always happens on the primary interface.
+
+    :param source_specific: Send each output jack to a group in the source-specific multicast
+        range (232.0.0.0/8), which inputs join for the sending interface only, so that they never
+        receive traffic from another sender. This needs IGMPv3 on the network.
+
+    :param unicast_limit: Output jacks patched to inputs on at most this many other modules send
+        each block to those modules by unicast, which keeps the stream off switches that do not
+        snoop IGMP. Above it, or when set to ``0``, a single datagram goes to the jack's
+        multicast group. Jacks switch as inputs are patched without losing a block.
+
+    :param sample_format: Format of the samples processed by the module and sent by its output
+        jacks: ``INT16`` (``np.int16``), ``INT24`` (``np.int32`` in memory, packed into three bytes
+        when sent) or ``FLOAT32`` (``np.float32`` with full scale at 1.0). Input jacks convert
+        streams from modules using another format, so a chain of modules sharing a format never
+        converts.
     """
 
     def __init__(
@@ -66,7 +116,15 @@ class Module:
         name: str,
         event_handler: EventHandler = None,
         id: str = None,
+        transport: Optional[Transport] = None,
+        bundle_mtu: Optional[int] = None,
+        block_size: int = BLOCK_SIZE,
+        sample_format: SampleFormat = SampleFormat.INT16,
+        jack_interfaces: Optional[List[str]] = None,
+        source_specific: bool = False,
+        unicast_limit: int = 2,
     ):
+        assert SAMPLE_RATE % block_size == 0
         self.name = name
         self.event_handler = event_handler or EventHandler()
         self.uuid: str = id or str(uuid.uuid4())
@@ -76,14 +134,33 @@ class Module:
         self.outputs: Dict[int, OutputJack] = {}
         self.broadcast_addr = None
         self.tick_time = None
+        self.sample_clock = 0
+        self.running = False
+        self.scheduler_stats = SchedulerStats()
+        self.block_size = block_size
+        self.packet_rate = SAMPLE_RATE // block_size
+        self.sample_format = sample_format
+        self.sample_type = SAMPLE_DTYPES[sample_format]
+        self.unicast_limit = unicast_limit
+        self.transport = transport or UdpTransport()
+        # Blocks start on multiples of the block period in network time, shared by all modules
+        self.clock = NetworkClock(self.transport.time)
+        self.clock_steps = 0
+        # Jacks on the same host are only told apart from remote ones if the transport allows
+        # bypassing it
+        self.host = HOST_ID if self.transport.shortcuts else None
+
+        addresses = self.transport.interfaces()
+        for detail in addresses:
+            logging.info("Address found: " + str(detail))
 
-        addresses = []
-        for interface in netifaces.interfaces():
-            interfaces_details = netifaces.ifaddresses(interface)
-            if netifaces.AF_INET in interfaces_details:
-                for detail in interfaces_details[netifaces.AF_INET]:
-                    addresses.append(detail)
-                    logging.info("Address found: " + str(detail))
+        # Listeners and servers of every interface carrying jacks, starting with the primary one,
+        # and the network each interface is on
+        self.jack_listener: Optional[InputJackListener] = None
+        self.jack_server: Optional[OutputJackServer] = None
+        self.jack_listeners: List[InputJackListener] = []
+        self.jack_servers: List[OutputJackServer] = []
+        self.jack_networks: List[ipaddress.IPv4Network] = []
 
         if len(addresses) == 0:
             return
@@ -93,39 +170,173 @@ class Module:
             if detail["broadcast"] == PREFERRED_BROADCAST:
                 self.broadcast_addr = detail
 
-        self.patch_server = PatchServer(self.uuid, self.broadcast_addr["addr"])
-        self.leader_election = LeaderElection(self.uuid, self.patch_server)
+        address = self.broadcast_addr["addr"]
+        self.patch_server = PatchServer(self.uuid, address, self.transport)
+        self.jack_listener = InputJackListener(address, transport=self.transport)
+        self.jack_server = OutputJackServer(
+            address,
+            self.transport,
+            bundle_mtu,
+            self.packet_rate,
+            source_specific,
+            self.uuid,
+        )
+
+        self.jack_listeners.append(self.jack_listener)
+        self.jack_servers.append(self.jack_server)
+        self.jack_networks.append(interface_network(self.broadcast_addr))
+        for detail in addresses:
+            extra = detail["addr"]
+            if extra == address or extra not in (jack_interfaces or []):
+                continue
+            self.jack_listeners.append(
+                InputJackListener(extra, transport=self.transport)
+            )
+            self.jack_servers.append(
+                OutputJackServer(
+                    extra,
+                    self.transport,
+                    bundle_mtu,
+                    self.packet_rate,
+                    source_specific,
+                    self.uuid,
+                )
+            )
+            self.jack_networks.append(interface_network(detail))
+        self.leader_election = LeaderElection(
+            self.uuid,
+            self.patch_server,
+            self.transport.time,
+            self.transport.rng,
+            self.clock,
+        )
 
     def update(self):
         """Process all pending tasks: send and recieve directives, audio and control data and
         perform callbacks if requested. This should be run periodically in an event loop or a
-        thread.
+        thread, unless the module is driven by ``run`` instead. Blocks created back to back to
+        catch up after a late update are paced out over the following updates rather than sent
+        as one burst.
         """
-        if self.tick_time is None:
-            self.tick_time = time.perf_counter()
         while (message := self.patch_server.get_message()) is not None:
             self.event_process(message)
-        dt = time.perf_counter() - self.tick_time
-        while dt > (1 / PACKET_RATE):
+        if self.leader_election.collisions:
+            self.resolve_collisions()
+        if self.tick_time is None or self.clock.stats.steps != self.clock_steps:
+            self.align_blocks()
+        for server in self.jack_servers:
+            server.pace()
+        period = 1 / self.packet_rate
+        while self.clock.time() >= self.tick_time + period:
+            for listener in self.jack_listeners:
+                listener.update()
             for jack in self.inputs.values():
                 jack.update()
             self.block_create()
             self.leader_election.update(None)
-            self.tick_time += 1 / PACKET_RATE
-            dt = time.perf_counter() - self.tick_time
+            self.sample_clock += self.block_size
+            self.tick_time = self.sample_clock / SAMPLE_RATE
 
-    def add_input(self, name: str) -> InputJack:
+    def align_blocks(self) -> None:
+        """Starts counting blocks from the current network time, when starting up or after the
+        network clock has been stepped
+        """
+        blocks = int(self.clock.time() * self.packet_rate)
+        self.sample_clock = blocks * self.block_size
+        self.tick_time = self.sample_clock / SAMPLE_RATE
+        self.clock_steps = self.clock.stats.steps
+
+    def run(self, duration: Optional[float] = None) -> None:
+        """Runs the module on its own, waking up on the absolute deadline of each block instead of
+        being polled by an event loop. This blocks until ``stop`` is called, a halt directive is
+        received or ``duration`` seconds have passed, so it is best given a thread or process of
+        its own.
+
+        :param duration: Time in seconds to run for, or ``None`` to run until stopped
+        """
+        self.running = True
+        end = None if duration is None else self.transport.time() + duration
+        self.update()
+        while self.running:
+            deadline = self.tick_time + 1 / self.packet_rate
+            local_deadline = self.clock.to_local(deadline)
+            if end is not None and local_deadline > end:
+                break
+            # Blocks held back by pacing are released between block deadlines
+            send_times = [server.next_send_time() for server in self.jack_servers]
+            send_times = [time for time in send_times if time is not None]
+            if send_times and min(send_times) < local_deadline:
+                self.transport.wait_until(min(send_times))
+                for server in self.jack_servers:
+                    server.pace()
+                continue
+            self.transport.wait_until(local_deadline)
+            self.scheduler_record(self.clock.time() - deadline)
+            self.update()
+        self.running = False
+
+    def stop(self) -> None:
+        """Makes ``run`` return after the block it is processing"""
+        self.running = False
+
+    def scheduler_record(self, lateness: float) -> None:
+        stats = self.scheduler_stats
+        stats.wakeups += 1
+        stats.lateness = lateness
+        stats.max_lateness = max(stats.max_lateness, lateness)
+        stats.mean_lateness += (lateness - stats.mean_lateness) / stats.wakeups
+        if lateness > 1 / self.packet_rate:
+            stats.missed += 1
+
+    def add_input(
+        self,
+        name: str,
+        target_depth: int = JITTER_TARGET_DEPTH,
+        resample: bool = False,
+        concealment: Concealment = Concealment.HOLD,
+    ) -> InputJack:
         """Adds a new input jack to the module
 
         :param name: Identifier describing the new jack
 
-        :return: The created jack instance
+        :param target_depth: Number of blocks to buffer before playing out data received on this
+            jack. Larger values tolerate more network jitter at the cost of latency.
+
+        :param resample: Resample the received stream to hold the buffered latency steady when
+            the sending module's clock is not locked to this module's, for instance when one end
+            is clocked by a sound card. The estimated ratio of the two sample rates is reported in
+            the jack's stats.
+
+        :param concealment: How blocks missing from the stream are filled in: ``HOLD`` repeats
+            the last block, which suits control voltages, while ``FADE`` and ``EXTRAPOLATE``
+            (continuing the waveform) avoid the buzz that repeating audio blocks produces.
+
+        :return: The created jack instance, which can only be patched to outputs on the network if
+            the host has a network interface
         """
-        jack = InputJack(name)
+        jack = InputJack(
+            name,
+            self.jack_listener,
+            target_depth,
+            self.block_size,
+            self.sample_format,
+            resample,
+            concealment,
+        )
         self.inputs[jack.id] = jack
+        if self.transport.shortcuts:
+            local_inputs[(self.uuid, jack.id)] = jack
         return jack
 
-    def add_output(self, name: str, color: int) -> OutputJack:
+    def add_output(
+        self,
+        name: str,
+        color: int,
+        always_send: bool = False,
+        fec: Optional[int] = None,
+        compress: bool = False,
+        compact: bool = False,
+    ) -> OutputJack:
         """Adds a new output jack to the module
 
         :param name: Identifier describing the new jack
@@ -133,10 +344,48 @@ class Module:
         :param color: An HSV Hue value for the jack's primary color in [0, 360). This color is
             propagated to any input jacks that it is patched to.
 
+        :param always_send: Send data even while no input jacks are patched, for instance to feed
+            a monitoring tap. By default, unpatched outputs only send an occasional keepalive.
+
+        :param fec: Send a parity frame after every ``fec`` blocks on the network, from which
+            input jacks rebuild a single lost block of the group without a resend. This costs
+            one extra packet per group, and only blocks not yet due to be played can be rebuilt,
+            so the protection is complete once the input's jitter buffer holds ``fec`` blocks.
+
+        :param compress: Losslessly compress each block sent to the network on its own, without
+            adding latency, for links too slow to carry many uncompressed streams. Blocks that
+            do not get smaller are sent as they are, and inputs expand compressed blocks as they
+            arrive. This needs an integer sample format. The achieved compression and the time
+            spent per block are reported in the jack's stats.
+
+        :param compact: Send blocks that hold the same value throughout each channel, as control
+            voltages and gates mostly do, as a single sample per channel, and blocks identical to
+            the previous one as a bare header. A block is still sent in full after every
+            ``OutputJack.compact_refresh`` compact frames, so that a lost block only stops inputs
+            from expanding the repeats that follow it for a short while.
+
         :return: The created jack instance
         """
-        jack = OutputJack(self.broadcast_addr["addr"], name, color)
+        if not self.jack_servers:
+            raise RuntimeError("No network interface to send output jacks from")
+        server = min(self.jack_servers, key=lambda server: server.load)
+        jack = OutputJack(
+            server,
+            name,
+            color,
+            always_send,
+            self.block_size,
+            self.sample_format,
+            fec,
+            compress,
+            compact,
+            self.unicast_limit,
+        )
+        server.add_load(jack.bit_rate())
         self.outputs[jack.id] = jack
+        if self.transport.shortcuts:
+            local_outputs[(self.uuid, jack.id)] = jack
+        self.update_patch()
         return jack
 
     def get_jack_color(self, jack: Jack) -> int:
@@ -153,6 +402,34 @@ class Module:
         """
         return jack.get_level()
 
+    def get_jack_stats(self, jack: Jack) -> JackStats:
+        """Returns the traffic counters of a jack, such as the number of blocks sent, received or
+        lost on the network.
+
+        :param jack: The specific jack instance
+        """
+        return jack.get_stats()
+
+    def get_sender_stats(self) -> SenderStats:
+        """Returns the counters of datagrams and system calls used to send output jack data,
+        totalled over all of the module's interfaces
+        """
+        if len(self.jack_servers) == 1:
+            return self.jack_server.stats
+        total = SenderStats()
+        for server in self.jack_servers:
+            for name, value in vars(server.stats).items():
+                setattr(total, name, getattr(total, name) + value)
+        return total
+
+    def get_scheduler_stats(self) -> SchedulerStats:
+        """Returns how closely ``run`` has woken up on the deadline of each block"""
+        return self.scheduler_stats
+
+    def get_clock_stats(self) -> ClockStats:
+        """Returns the state of the network clock that block boundaries are aligned to"""
+        return self.clock.stats
+
     def get_patch_state(self) -> PatchState:
         """Retrieves the global patch state"""
         return self.patch_state
@@ -191,24 +468,117 @@ class Module:
     def update_patch(self) -> None:
         """Triggers an update in the shared global state"""
         held_inputs = [
-            HeldInputJack(uuid=self.uuid, id=jack.id)
+            self.held_input_jack(jack)
             for jack in self.inputs.values()
             if jack.patch_enabled
         ]
         held_outputs = [
-            HeldOutputJack(
-                uuid=self.uuid,
-                id=jack.id,
-                color=jack.color,
-                addr=jack.endpoint[0],
-                port=jack.endpoint[1],
-            )
+            self.held_output_jack(jack)
             for jack in self.outputs.values()
             if jack.patch_enabled
         ]
-        self.leader_election.update_local_state(LocalState(held_inputs, held_outputs))
+        groups = sorted({jack.endpoint[0] for jack in self.outputs.values()})
+        self.leader_election.update_local_state(
+            LocalState(held_inputs, held_outputs, groups)
+        )
+
+    def resolve_collisions(self) -> None:
+        """Moves the output jacks sending to a group that the leader found another module sending
+        to as well, unless this module has the lowest uuid of those sharing it. Inputs patched to
+        a moved output are told to connect to it again.
+        """
+        moved = False
+        for group, uuids in self.leader_election.collisions.items():
+            if self.uuid not in uuids[1:]:
+                continue
+            for server in self.jack_servers:
+                jacks = [
+                    jack
+                    for jack in self.outputs.values()
+                    if jack.jack_server is server and jack.endpoint[0] == group
+                ]
+                if not jacks:
+                    continue
+                logging.warning(f"Multicast group {group} is shared, moving it")
+                endpoint = server.reallocate(jacks[0].endpoint)
+                for jack in jacks:
+                    jack.move(endpoint)
+                    for input_uuid, input_id in jack.connected_jacks:
+                        connection = PatchConnection(
+                            input_uuid, input_id, self.uuid, jack.id
+                        )
+                        self.patch_server.message_send(
+                            SetInputJack(
+                                uuid=self.uuid,
+                                source=self.held_output_jack(jack),
+                                connection=connection,
+                            )
+                        )
+                moved = True
+        if moved:
+            self.update_patch()
+
+    def held_input_jack(self, jack: InputJack) -> HeldInputJack:
+        """Describes an input jack of this module to the other modules. An input that could not
+        attach to its output's shared memory leaves out the host, so that the output sends to it
+        over the network.
+        """
+        return HeldInputJack(
+            uuid=self.uuid,
+            id=jack.id,
+            host=None if jack.shm_missing else self.host,
+            endpoints=[
+                (listener.address, listener.unicast_port)
+                for listener in self.jack_listeners
+            ],
+        )
+
+    def held_output_jack(self, jack: OutputJack) -> HeldOutputJack:
+        """Describes an output jack of this module to the other modules"""
+        return HeldOutputJack(
+            uuid=self.uuid,
+            id=jack.id,
+            color=jack.color,
+            addr=jack.endpoint[0],
+            port=jack.endpoint[1],
+            host=self.host,
+            shm=jack.shared_writer.name if jack.shared_writer else None,
+            stream=jack.stream,
+            interface=jack.jack_server.address,
+            block_size=jack.parser.block_size,
+            sample_format=jack.parser.sample_format,
+            fec=jack.fec,
+        )
+
+    def listener_for(self, interface: Optional[str]) -> InputJackListener:
+        """Picks the listener on the same network as the interface an output sends from, or the
+        primary one if there is none
+        """
+        if interface is not None:
+            address = ipaddress.ip_address(interface)
+            for listener, network in zip(self.jack_listeners, self.jack_networks):
+                if address in network:
+                    return listener
+        return self.jack_listener
+
+    def unicast_endpoint(
+        self, jack: OutputJack, input: HeldInputJack
+    ) -> Optional[Tuple[str, int]]:
+        """Picks the endpoint that an input's module receives unicast streams on from the network
+        that an output jack sends on, if it advertised one there
+        """
+        network = self.jack_networks[self.jack_servers.index(jack.jack_server)]
+        for address, port in input.endpoints:
+            if ipaddress.ip_address(address) in network:
+                return address, port
+        return None
+
+    def is_local(self, host: Optional[str]) -> bool:
+        """Checks whether a jack advertised with ``host`` is on the same host as this module"""
+        return self.host is not None and host == self.host
 
     def halt_callback(self) -> None:
+        self.stop()
         self.event_handler.halt()
 
     def halt_all(self) -> None:
@@ -274,14 +644,7 @@ class Module:
         if input_jack.is_connected(output_uuid, output_id):
             input_jack.disconnect(output_uuid, output_id)
         else:
-            input_jack.connect(
-                self.broadcast_addr["addr"],
-                output.addr,
-                output.port,
-                output.color,
-                output.uuid,
-                output.id,
-            )
+            self.connect_input(input_jack, output)
 
     def toggle_output_connection(self, input, output) -> None:
         """Toggles an output connection that is owned by this module, either connecting it to the
@@ -297,26 +660,70 @@ class Module:
         if output_jack.is_connected(input_uuid, input_id):
             output_jack.disconnect(input_uuid, input_id)
         else:
-            output_jack.connect(input_uuid, input_id)
+            output_jack.connect(
+                input_uuid,
+                input_id,
+                local=self.is_local(input.host),
+                endpoint=self.unicast_endpoint(output_jack, input),
+            )
+
+    def connect_input(
+        self, input_jack: InputJack, output: HeldOutputJack, reply: bool = False
+    ) -> None:
+        """Connects an input jack of this module to an output jack, taking the blocks directly
+        when the output is in this interpreter, using shared memory when it is on the same host and
+        the network otherwise. The output's module is told where the input is if ``reply`` is
+        set, as the output only learns that when patching, and whenever the input could not
+        attach to the output's shared memory, so that the output sends to it over the network.
+        """
+        input_jack.connect(
+            output.addr,
+            output.port,
+            output.color,
+            output.uuid,
+            output.id,
+            shm=output.shm if self.is_local(output.host) else None,
+            stream=output.stream,
+            listener=self.listener_for(output.interface),
+            source=output.interface if is_source_specific(output.addr) else None,
+            block_size=output.block_size,
+            sample_format=output.sample_format,
+            fec=output.fec,
+        )
+        if reply or input_jack.shm_missing:
+            connection = PatchConnection(
+                self.uuid, input_jack.id, output.uuid, output.id
+            )
+            self.patch_server.message_send(
+                SetOutputJack(
+                    uuid=self.uuid,
+                    source=self.held_input_jack(input_jack),
+                    connection=connection,
+                )
+            )
 
     def block_create(self) -> None:
         """Gathers all input data into a single matrix for block processing"""
 
         num_inputs = len(self.inputs)
         num_outputs = len(self.outputs)
-        result = np.zeros((num_inputs, BLOCK_SIZE, CHANNELS), dtype=SAMPLE_TYPE)
+        result = np.zeros(
+            (num_inputs, self.block_size, CHANNELS), dtype=self.sample_type
+        )
         for i, in_jack in enumerate(self.inputs.values()):
             result[i, :, :] = in_jack.get_data()
         post_process = self.event_handler.process(result)
         if num_outputs > 0:
             assert post_process.shape == (
                 num_outputs,
-                BLOCK_SIZE,
+                self.block_size,
                 CHANNELS,
             )
-            assert post_process.dtype == SAMPLE_TYPE
+            assert post_process.dtype == self.sample_type
             for i, out_jack in enumerate(self.outputs.values()):
-                out_jack.send(post_process[i, :, :])
+                out_jack.send(post_process[i, :, :], self.sample_clock)
+            for server in self.jack_servers:
+                server.flush()
 
     def event_process(self, message: Directive):
         """Primary event handler for messages on the patching port"""
@@ -372,20 +779,20 @@ class Module:
 
         if isinstance(message, SetInputJack):
             if message.connection.input_uuid == self.uuid:
-                self.inputs[message.connection.input_jack_id].connect(
-                    self.broadcast_addr["addr"],
-                    message.source.addr,
-                    message.source.port,
-                    message.source.color,
-                    message.connection.output_uuid,
-                    message.connection.output_jack_id,
+                self.connect_input(
+                    self.inputs[message.connection.input_jack_id],
+                    message.source,
+                    reply=True,
                 )
 
         if isinstance(message, SetOutputJack):
             if message.connection.output_uuid == self.uuid:
-                self.outputs[message.connection.output_jack_id].connect(
+                output_jack = self.outputs[message.connection.output_jack_id]
+                output_jack.connect(
                     message.connection.input_uuid,
                     message.connection.input_jack_id,
+                    local=self.is_local(message.source.host),
+                    endpoint=self.unicast_endpoint(output_jack, message.source),
                 )
 
         if (
@@ -433,17 +840,12 @@ class Module:
         for id, out_jack in self.outputs.items():
             out_jack.clear()
             for p in output_patches[id]:
+                # Sent to by multicast until the input's module answers with where it is
                 out_jack.connect(p.input_uuid, p.input_jack_id)
                 self.patch_server.message_send(
                     SetInputJack(
                         uuid=self.uuid,
-                        source=HeldOutputJack(
-                            uuid=self.uuid,
-                            id=id,
-                            color=out_jack.color,
-                            addr=out_jack.endpoint[0],
-                            port=out_jack.endpoint[1],
-                        ),
+                        source=self.held_output_jack(out_jack),
                         connection=p,
                     )
                 )
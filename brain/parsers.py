@@ -1,6 +1,10 @@
 import json
+import socket
+import struct
 
-from typing import Optional
+from typing import Final, Optional, Tuple
+from .constants import BLOCK_SIZE, CHANNELS, JACK_PROTOCOL_VERSION
+from .formats import SAMPLE_WIDTHS
 from .protocol import (
     Directive,
     GlobalStateUpdate,
@@ -8,11 +12,13 @@ from .protocol import (
     SnapshotResponse,
     SetPreset,
     SetInputJack,
+    SetOutputJack,
     Halt,
     Heartbeat,
     HeartbeatResponse,
     RequestVote,
     RequestVoteResponse,
+    SampleFormat,
 )
 
 
@@ -41,6 +47,8 @@ class MessageParser:
                 return SetPreset.from_dict(resp["SetPreset"])
             if "SetInputJack" in resp:
                 return SetInputJack.from_dict(resp["SetInputJack"])
+            if "SetOutputJack" in resp:
+                return SetOutputJack.from_dict(resp["SetOutputJack"])
             if "Halt" in resp:
                 return Halt.from_dict(resp["Halt"])
 
@@ -68,6 +76,8 @@ class MessageParser:
             return json.dumps({"SetPreset": resp}).encode()
         if isinstance(message, SetInputJack):
             return json.dumps({"SetInputJack": resp}).encode()
+        if isinstance(message, SetOutputJack):
+            return json.dumps({"SetOutputJack": resp}).encode()
         if isinstance(message, Halt):
             return json.dumps({"Halt": resp}).encode()
 
@@ -83,3 +93,154 @@ class MessageParser:
             return json.dumps({"GlobalStateUpdate": resp}).encode()
 
         raise NotImplementedError
+
+
+class BlockParser:
+    """Determines how blocks of sample data sent between jacks get translated into raw bytes in the
+    udp packets. Each frame is a fixed-size header followed by a single block of samples, and a
+    datagram holds either one frame or, for bundled outputs, several frames back to back.
+    Compressed blocks are preceded by their length in bytes instead, since it varies, and compact
+    frames carry a single sample per channel or nothing at all.
+
+    :param block_size: Number of samples per channel in each block of the stream
+
+    :param sample_format: Encoding of the samples in the stream
+    """
+
+    #: Protocol version, sample format, block size, stream id, sequence number and sample clock
+    #: timestamp
+    header: Final = struct.Struct("!BBHIIQ")
+
+    #: Location of the sample format, block size and stream id within the header
+    frame_fields: Final = struct.Struct("!xBHI")
+
+    #: Bit set in the sample format of parity frames, whose payload is the XOR of the payloads of
+    #: a group of consecutive blocks starting at the frame's sequence number
+    parity_flag: Final = 0x80
+
+    #: Bit set in the sample format of frames whose block is compressed by ``RiceCodec``
+    compressed_flag: Final = 0x40
+
+    #: Bit set in the sample format of frames for a block that holds the same value throughout
+    #: each channel, whose payload is that value for each channel
+    constant_flag: Final = 0x20
+
+    #: Bit set in the sample format of frames for a block identical to the one before it in the
+    #: stream, which have no payload
+    repeat_flag: Final = 0x10
+
+    #: Bits of the sample format that hold flags rather than the format itself
+    flag_mask: Final = 0xF0
+
+    #: Length of a compressed block, which follows the header
+    length: Final = struct.Struct("!H")
+
+    def __init__(
+        self,
+        block_size: int = BLOCK_SIZE,
+        sample_format: SampleFormat = SampleFormat.INT16,
+    ):
+        self.block_size = block_size
+        self.sample_format = sample_format
+        #: Number of payload bytes in a full block
+        self.payload_size = block_size * CHANNELS * SAMPLE_WIDTHS[sample_format]
+
+    def stream_id(self, mult_addr: str) -> int:
+        """Stream id used in the headers of the output jack that sends to ``mult_addr``, which is
+        simply the group address as an integer.
+        """
+        return int.from_bytes(socket.inet_aton(mult_addr), "big")
+
+    def create_header(
+        self, buffer, stream: int, sequence: int, timestamp: int, flags: int = 0
+    ) -> None:
+        """Writes a header for a block of the stream to the start of ``buffer``
+
+        :param buffer: Writable buffer at least ``header.size`` bytes long
+
+        :param stream: Id of the stream the block belongs to
+
+        :param sequence: Stream sequence number, incremented once per block sent
+
+        :param timestamp: Sender's sample clock at the first sample of the block
+
+        :param flags: Any of ``parity_flag``, ``compressed_flag``, ``constant_flag`` and
+            ``repeat_flag`` describing the payload. Compressed blocks need their length written
+            after the header as well.
+        """
+        self.header.pack_into(
+            buffer,
+            0,
+            JACK_PROTOCOL_VERSION,
+            self.sample_format | flags,
+            self.block_size,
+            stream,
+            sequence & 0xFFFFFFFF,
+            timestamp & 0xFFFFFFFFFFFFFFFF,
+        )
+
+    def frame_size(
+        self, buffer, nbytes: int, offset: int, format: int, block_size: int
+    ) -> Optional[int]:
+        """Works out the length in bytes of the frame at ``offset`` from its sample format,
+        flags included, and block size
+
+        :return: The length, or ``None`` if the format is unknown or the datagram too short to
+            hold the length of a compressed block
+        """
+        size = self.header.size
+        if format & self.compressed_flag:
+            start = offset + size
+            if nbytes - start < self.length.size:
+                return None
+            (length,) = self.length.unpack_from(buffer, start)
+            return size + self.length.size + length
+        width = SAMPLE_WIDTHS.get(format & ~self.flag_mask)
+        if width is None:
+            return None
+        if format & self.repeat_flag:
+            return size
+        if format & self.constant_flag:
+            return size + CHANNELS * width
+        return size + block_size * CHANNELS * width
+
+    def parse_frame(
+        self, buffer, nbytes: int, offset: int = 0
+    ) -> Optional[Tuple[int, int]]:
+        """Reads the stream id and length of the frame at ``offset`` in a received datagram so
+        that it can be routed to its jack.
+
+        :return: The stream id and frame length in bytes, or ``None`` if the rest of the datagram
+            is too short to hold a header or is in an unknown sample format
+        """
+        if nbytes - offset < self.header.size:
+            return None
+        format, block_size, stream = self.frame_fields.unpack_from(buffer, offset)
+        size = self.frame_size(buffer, nbytes, offset, format, block_size)
+        if size is None:
+            return None
+        return stream, size
+
+    def parse_header(self, buffer, nbytes: int) -> Optional[Tuple[int, int, int]]:
+        """Checks that a received datagram holds a single block in the expected format.
+
+        :param buffer: Buffer that the datagram was received into
+
+        :param nbytes: Length of the datagram
+
+        :return: The sequence number, the timestamp and the flags describing the payload, or
+            ``None`` if the datagram was rejected
+        """
+        if nbytes < self.header.size:
+            return None
+        version, format, block_size, _, sequence, timestamp = self.header.unpack_from(
+            buffer
+        )
+        if (
+            version != JACK_PROTOCOL_VERSION
+            or format & ~self.flag_mask != self.sample_format
+            or block_size != self.block_size
+            or self.frame_size(buffer, nbytes, 0, format, block_size) != nbytes
+        ):
+            return None
+        return sequence, timestamp, format & self.flag_mask
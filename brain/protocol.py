@@ -1,7 +1,9 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from dataclasses_json import DataClassJsonMixin
-from enum import Enum
-from typing import List, Optional
+from enum import Enum, IntEnum
+from typing import Dict, List, Optional, Tuple
+
+from .constants import BLOCK_SIZE
 
 # Convenience structures for defining current patching states and connections
 
@@ -19,10 +21,24 @@ class PatchState(str, Enum):
     BLOCKED = "Blocked"
 
 
+class SampleFormat(IntEnum):
+    """Encoding of the samples carried in a jack datagram"""
+
+    #: Signed 16-bit integers in native byte order
+    INT16 = 0
+    #: Signed 24-bit integers packed into three bytes, least significant byte first
+    INT24 = 1
+    #: 32-bit floats in native byte order, with full scale at 1.0
+    FLOAT32 = 2
+
+
 @dataclass
 class HeldInputJack(DataClassJsonMixin):
     uuid: str
     id: int
+    host: Optional[str] = None
+    #: Address and port that each of the module's listeners receives unicast streams on
+    endpoints: List[Tuple[str, int]] = field(default_factory=list)
 
 
 @dataclass
@@ -32,12 +48,21 @@ class HeldOutputJack(DataClassJsonMixin):
     color: int
     addr: str
     port: int
+    host: Optional[str] = None
+    shm: Optional[str] = None
+    stream: Optional[int] = None
+    interface: Optional[str] = None
+    block_size: int = BLOCK_SIZE
+    sample_format: SampleFormat = SampleFormat.INT16
+    fec: Optional[int] = None
 
 
 @dataclass
 class LocalState(DataClassJsonMixin):
     held_inputs: List[HeldInputJack]
     held_outputs: List[HeldOutputJack]
+    #: Multicast groups that the module's output jacks send to, patched or not
+    groups: List[str] = field(default_factory=list)
 
 
 @dataclass
@@ -101,6 +126,13 @@ class Heartbeat(Directive, DataClassJsonMixin):
     uuid: str
     term: int
     iteration: int
+    #: Network time at which the heartbeat was sent
+    time: Optional[float] = None
+    #: Network time at which the leader received each module's response to the previous heartbeat
+    response_times: Dict[str, float] = field(default_factory=dict)
+    #: Multicast groups that more than one module sends to, with the uuids of those modules in
+    #: sorted order. All but the first have to move their outputs to another group.
+    collisions: Dict[str, List[str]] = field(default_factory=dict)
 
 
 @dataclass
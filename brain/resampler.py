@@ -0,0 +1,120 @@
+# Two modules whose clocks are not locked together (no network clock, or a sound card clocking one
+# end) produce and consume blocks at rates a few ppm apart, so the jitter buffer between them slowly
+# fills up or runs dry. An input jack can instead read its stream through a fractional resampler
+# whose rate is steered by a proportional-integral loop on the buffer's fill level. The integral
+# term settles on the ratio between the producer's and the consumer's sample rates.
+
+import numpy as np
+
+from typing import Callable, Final, Optional
+
+from .constants import CHANNELS, SAMPLE_RATE
+
+
+class Resampler:
+    """Reads a stream of blocks at an adjustable rate using linear interpolation
+
+    :param block_size: Number of samples per channel in each block returned
+
+    :param source_block_size: Number of samples per channel in each block of the stream
+
+    :param sample_type: Numpy type of the samples
+    """
+
+    #: Rate correction per block of fill level error
+    proportional_gain: Final = 1e-3
+    #: Rate correction per second per block of fill level error
+    integral_gain: Final = 1e-4
+    #: Largest correction of the rate
+    max_deviation: Final = 0.002
+    #: Number of blocks the fill level is smoothed over
+    level_smoothing: Final = 256
+
+    def __init__(self, block_size: int, source_block_size: int, sample_type: type):
+        self.block_size = block_size
+        self.source_block_size = source_block_size
+        self.integer = np.issubdtype(sample_type, np.integer)
+        self.block = np.zeros((block_size, CHANNELS), dtype=sample_type)
+
+        # Samples of the stream not yet consumed, with room for a full block at the fastest rate
+        # plus one more stream block
+        size = int(block_size * (1 + self.max_deviation)) + source_block_size + 3
+        self.history = np.zeros((size, CHANNELS))
+        self.filled = 0
+        self.position = 0.0
+
+        self.steps = np.arange(block_size, dtype=np.float64)
+        self.positions = np.zeros(block_size)
+        self.fraction = np.zeros((block_size, 1))
+        self.index = np.zeros(block_size, dtype=np.intp)
+        self.next_index = np.zeros(block_size, dtype=np.intp)
+        self.left = np.zeros((block_size, CHANNELS))
+        self.right = np.zeros((block_size, CHANNELS))
+
+        self.ratio = 1.0
+        self.level = None
+        self.block_time = block_size / SAMPLE_RATE
+
+    def pending(self) -> float:
+        """Number of stream blocks read in but not yet played"""
+        return (self.filled - self.position) / self.source_block_size
+
+    def steer(self, error: Optional[float]) -> float:
+        """Updates the rate from the difference in blocks between the fill level and its target
+
+        :return: The rate to read the next block at, in stream samples per output sample
+        """
+        if error is None:
+            return self.ratio
+        if self.level is None:
+            self.level = error
+        self.level += (error - self.level) / self.level_smoothing
+        self.ratio += self.integral_gain * self.level * self.block_time
+        self.ratio = min(
+            max(self.ratio, 1 - self.max_deviation), 1 + self.max_deviation
+        )
+        rate = self.ratio + self.proportional_gain * self.level
+        return min(max(rate, 1 - self.max_deviation), 1 + self.max_deviation)
+
+    def read(
+        self, pull: Callable[[], np.ndarray], error: Optional[float]
+    ) -> np.ndarray:
+        """Produces the next block
+
+        :param pull: Returns the next block of the stream
+
+        :param error: Number of blocks by which the buffer feeding ``pull`` is above its target,
+            or ``None`` while it is not playing, which keeps the current rate
+
+        :return: The resampled block, which is overwritten by the next read
+        """
+        rate = self.steer(error)
+        np.multiply(self.steps, rate, out=self.positions)
+        self.positions += self.position
+        needed = int(self.positions[-1]) + 2
+        while self.filled < needed:
+            start = self.filled
+            end = start + self.source_block_size
+            self.history[start:end] = pull()
+            self.filled = end
+
+        np.copyto(self.index, self.positions, casting="unsafe")
+        np.add(self.index, 1, out=self.next_index)
+        np.subtract(self.positions, self.index, out=self.fraction[:, 0])
+        np.take(self.history, self.index, axis=0, out=self.left)
+        np.take(self.history, self.next_index, axis=0, out=self.right)
+        self.right -= self.left
+        self.right *= self.fraction
+        self.left += self.right
+        if self.integer:
+            np.rint(self.left, out=self.left)
+        np.copyto(self.block, self.left, casting="unsafe")
+
+        # Discard the samples that have been played
+        self.position += rate * self.block_size
+        consumed, filled = int(self.position), self.filled
+        remaining = filled - consumed
+        self.history[:remaining] = self.history[consumed:filled]
+        self.filled = remaining
+        self.position -= consumed
+        return self.block
@@ -1,90 +1,492 @@
 import logging
-import random
-import socket
-from typing import Optional
+import zlib
+from collections import Counter, deque
+from typing import Callable, Deque, Dict, Final, List, Optional, Set, Tuple
 
-from brain.constants import JACK_PORT, PATCH_ADDR, PATCH_PORT
-from brain.parsers import MessageParser
+from brain.constants import JACK_PORT, JACK_SEND_BATCH, PATCH_ADDR, PATCH_PORT
+from brain.mmsg import MessageBatch
+from brain.parsers import BlockParser, MessageParser
 from brain.protocol import Directive
+from brain.stats import SenderStats
+from brain.transport import DatagramSocket, Transport, UdpTransport
+
+#: Bytes of IP and UDP headers in front of each datagram
+UDP_OVERHEAD = 28
+
+#: First octet of the groups allocated to output jacks, from the administratively scoped range or
+#: the source-specific range
+ASM_PREFIX = 239
+SSM_PREFIX = 232
+
+
+def is_source_specific(group: str) -> bool:
+    """Checks whether a group is in the source-specific multicast range, 232.0.0.0/8"""
+    return group.startswith(f"{SSM_PREFIX}.")
 
 
 class InputJackListener:
-    def __init__(self) -> None:
-        self.connected = False
-
-    def connect(self, address: str, mult_addr: str, port: int) -> None:
-        self.sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind((address, port))
-        self.sock.setsockopt(
-            socket.IPPROTO_IP,
-            socket.IP_ADD_MEMBERSHIP,
-            socket.inet_aton(mult_addr) + socket.inet_aton(address),
-        )
-        self.sock.setblocking(False)
+    """Receives the data for every input jack of a module on a single socket. The socket joins the
+    multicast group of each connected output jack, and each frame is routed to the jack subscribed
+    to its stream id, so that polling costs a constant number of system calls per tick no matter
+    how many jacks are patched. Frames bundled into one datagram are split up here.
 
-        self.connected = True
+    Groups are joined once however many jacks subscribe to them. When the last jack leaves, the
+    group stays joined for ``membership_linger`` seconds, so re-patching to it (as when a preset
+    is loaded) costs no system calls or IGMP traffic. Since the kernel limits the groups joined
+    on one socket, further sockets bound to the same port are opened as they are needed. They
+    stay in a pool for the lifetime of the listener.
 
-    def disconnect(self):
-        if self.connected:
-            self.sock.close()
-            self.connected = False
+    Outputs with few subscribers send to each subscribing module by unicast instead. A further
+    socket bound to a port of its own on this interface receives those datagrams, and it is
+    routed in the same way.
 
-    def get_data(self) -> bytes:
-        data = b""
-        if self.connected:
+    :param address: Local ip4 address of the interface to receive on
+
+    :param port: Port that output jacks send to
+
+    :param transport: Transport to receive with, by default the host's UDP sockets
+    """
+
+    #: Most groups joined on one socket, the default ``igmp_max_memberships`` of Linux
+    max_memberships: Final = 20
+    #: Time in seconds that a group stays joined after its last subscriber leaves
+    membership_linger: Final = 10.0
+
+    def __init__(
+        self,
+        address: str,
+        port: int = JACK_PORT,
+        transport: Optional[Transport] = None,
+    ) -> None:
+        self.address = address
+        self.port = port
+        self.transport = transport or UdpTransport()
+        self.parser = BlockParser()
+        self.buffer = memoryview(bytearray(65536))
+        # Callbacks of every input jack subscribed to each stream
+        self.subscribers: Dict[int, List[Callable[[memoryview, int, float], None]]] = {}
+        # Number of subscribers of each joined group, the socket and source it was joined with
+        # and, for groups without subscribers, the time that the last one left, oldest first
+        self.memberships: Counter = Counter()
+        self.group_sockets: Dict[str, DatagramSocket] = {}
+        self.group_sources: Dict[str, Optional[str]] = {}
+        self.idle: Dict[str, float] = {}
+
+        self.sock = self.transport.open(address, port)
+        self.sockets = [self.sock]
+        self.socket_groups: Counter = Counter()
+
+        self.unicast = self.transport.open(address, 0, bind=address)
+        #: Port that outputs sending to this listener by unicast send to
+        self.unicast_port = self.unicast.local_port()
+
+    def subscribe(
+        self,
+        mult_addr: str,
+        port: int,
+        callback: Callable[[memoryview, int, float], None],
+        stream: Optional[int] = None,
+        source: Optional[str] = None,
+    ) -> None:
+        """Starts routing a stream sent to ``mult_addr`` to ``callback``, which is called with
+        a buffer starting at each received frame, the frame's length in bytes and the arrival
+        time.
+
+        :param stream: Id of the stream, by default the one derived from ``mult_addr``
+
+        :param source: Address of the sender, for a source-specific join that only receives its
+            traffic
+        """
+        if port != self.port:
+            logging.warning(f"Jack endpoint port {port} differs from {self.port}")
+        if mult_addr in self.idle and self.group_sources[mult_addr] != source:
+            # An idle group joined for another sender has to be joined again
+            self.leave(mult_addr)
+        if mult_addr in self.idle:
+            del self.idle[mult_addr]
+        elif mult_addr not in self.group_sockets:
+            self.join(mult_addr, source)
+        self.memberships[mult_addr] += 1
+        if stream is None:
+            stream = self.parser.stream_id(mult_addr)
+        self.subscribers.setdefault(stream, []).append(callback)
+
+    def unsubscribe(
+        self,
+        mult_addr: str,
+        callback: Callable[[memoryview, int, float], None],
+        stream: Optional[int] = None,
+    ) -> None:
+        """Stops routing a stream to ``callback``, leaving any other subscribers of the stream
+        in place
+        """
+        if stream is None:
+            stream = self.parser.stream_id(mult_addr)
+        callbacks = self.subscribers.get(stream, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self.subscribers.pop(stream, None)
+        self.memberships[mult_addr] -= 1
+        if self.memberships[mult_addr] == 0:
+            del self.memberships[mult_addr]
+            self.idle[mult_addr] = self.transport.time()
+
+    def join(self, group: str, source: Optional[str] = None) -> None:
+        """Joins a group on a socket of the pool with room for it, making room by leaving the
+        longest idle group or opening another socket if there is none
+        """
+        sock = self.free_socket()
+        if sock is None and self.idle:
+            self.leave(next(iter(self.idle)))
+            sock = self.free_socket()
+        if sock is None:
+            sock = self.transport.open(self.address, self.port)
+            self.sockets.append(sock)
+        sock.join(group, source)
+        self.group_sockets[group] = sock
+        self.group_sources[group] = source
+        self.socket_groups[sock] += 1
+
+    def free_socket(self) -> Optional[DatagramSocket]:
+        for sock in self.sockets:
+            if self.socket_groups[sock] < self.max_memberships:
+                return sock
+        return None
+
+    def leave(self, group: str) -> None:
+        """Leaves an idle group"""
+        del self.idle[group]
+        sock = self.group_sockets.pop(group)
+        self.socket_groups[sock] -= 1
+        sock.leave(group, self.group_sources.pop(group))
+
+    def release_idle(self, now: float) -> None:
+        """Leaves the groups that have had no subscribers for ``membership_linger`` seconds"""
+        for group, since in list(self.idle.items()):
+            if now - since < self.membership_linger:
+                break
+            self.leave(group)
+
+    def update(self) -> int:
+        """Drains every pending datagram from the sockets and routes its frames to their
+        subscribers, after leaving the groups that have been idle for long enough.
+
+        :return: The number of frames routed
+        """
+        routed = 0
+        arrival = self.transport.time()
+        if self.idle:
+            self.release_idle(arrival)
+        routed += self.drain(self.unicast, arrival)
+        for sock in self.sockets:
+            routed += self.drain(sock, arrival)
+        return routed
+
+    def drain(self, sock: DatagramSocket, arrival: float) -> int:
+        routed = 0
+        while True:
             try:
-                data = self.sock.recv(4096)
+                nbytes = sock.recv_into(self.buffer)
             except BlockingIOError:
-                return b""
-        return data
+                return routed
+            offset = 0
+            while (
+                frame := self.parser.parse_frame(self.buffer, nbytes, offset)
+            ) is not None:
+                stream, size = frame
+                callbacks = self.subscribers.get(stream)
+                if callbacks is not None:
+                    view = self.buffer[offset:] if offset else self.buffer
+                    for callback in callbacks:
+                        callback(view, min(size, nbytes - offset), arrival)
+                    routed += 1
+                offset += size
+
+    def close(self) -> None:
+        self.unicast.close()
+        for sock in self.sockets:
+            sock.close()
 
 
 class OutputJackServer:
-    def __init__(self, address, mult_addr=None) -> None:
-        self.sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-
-        # For now we just pick a random address in the multicast range for local testing purposes if
-        # one is not provided, but ideally this will likely be some function of the interface
-        # address for devices that all have their own ip (for instance, 10.0.42.69 => 239.42.69.(1,
-        # 2, ...)). Source-specific multicast could help here.
-
-        x, y, z = (
-            random.randrange(0, 255),
-            random.randrange(0, 255),
-            random.randrange(0, 255),
-        )
-        jack_addr = mult_addr or f"239.{x}.{y}.{z}"
-        self.endpoint = (jack_addr, JACK_PORT)
-        logging.info("Jack endpoint: " + str(self.endpoint) + " on " + address)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.setsockopt(
-            socket.IPPROTO_IP,
-            socket.IP_ADD_MEMBERSHIP,
-            socket.inet_aton(jack_addr) + socket.inet_aton(address),
+    """Sends the data for every output jack of a module. Blocks are queued as the jacks send them
+    and go out together on ``flush``, using a single ``sendmmsg`` system call per tick where the
+    platform supports it.
+
+    With ``bundle_mtu`` set, all output jacks share one multicast group and their blocks are packed
+    back to back into as few datagrams as fit in the MTU, each keeping its own stream id so that
+    receivers can pick out their frame. This cuts the packet rate of modules with many outputs,
+    especially on networks with jumbo frames.
+
+    With ``packet_rate`` set, flushes are paced by a token bucket. A module that falls behind
+    creates several blocks back to back, and sending them as one burst would overflow shallow
+    switch buffers. Only ``pacing_burst`` flushes may go out back to back. The datagrams of later
+    flushes are copied and held back, then released by ``pace`` at ``pacing_speedup`` times the
+    packet rate, so the backlog drains without another burst.
+
+    :param address: Local ip4 address of the interface to send on
+
+    :param transport: Transport to send with, by default the host's UDP sockets
+
+    :param bundle_mtu: MTU of the network in bytes if blocks should be bundled, for instance 9000
+        with jumbo frames
+
+    :param packet_rate: Nominal number of flushes per second to pace to, or ``None`` to send
+        every flush straight away
+
+    :param source_specific: Allocate groups from the source-specific multicast range, which
+        receivers join for this interface's address only
+
+    :param uuid: Id of the module, which picks where its groups start so that modules on the
+        same host allocate different ones
+    """
+
+    #: Number of flushes that may be sent back to back
+    pacing_burst: Final = 2
+    #: Rate relative to ``packet_rate`` at which held back flushes are released
+    pacing_speedup: Final = 2.0
+    #: Seconds over which the bandwidth used is measured
+    load_window: Final = 1.0
+
+    def __init__(
+        self,
+        address: str,
+        transport: Optional[Transport] = None,
+        bundle_mtu: Optional[int] = None,
+        packet_rate: Optional[float] = None,
+        source_specific: bool = False,
+        uuid: str = "",
+    ) -> None:
+        self.address = address
+        self.transport = transport or UdpTransport()
+        self.stats = SenderStats()
+        self.parser = BlockParser()
+        self.batch = MessageBatch(JACK_SEND_BATCH)
+        # Held back flushes are released through a batch of their own, so that they never mix
+        # with a flush being queued
+        self.released = MessageBatch(JACK_SEND_BATCH)
+        self.streams: Set[int] = set()
+        self.source_specific = source_specific
+        # Groups sent to, groups found to be used by other modules as well, and the index of the
+        # last group allocated, starting from a hash of the module's id
+        self.groups: Set[str] = set()
+        self.collided: Set[str] = set()
+        self.group_index = zlib.crc32(uuid.encode()) % 255
+        # Bits per second sent over the last complete measurement window, the stats when the
+        # current window started, and the nominal rate of the jacks added since then
+        self.measured_load = 0.0
+        self.window_start = self.transport.time()
+        self.window_bytes = 0
+        self.added_load = 0.0
+
+        self.sock = self.transport.open(address)
+
+        self.pacing_rate = (
+            None if packet_rate is None else packet_rate * self.pacing_speedup
         )
+        self.tokens = float(self.pacing_burst)
+        self.last_pace = self.transport.time()
+        # Datagrams held back, grouped by flush. Whether the flush in progress is held back is
+        # decided when its first datagrams are sent.
+        self.deferred: Deque[List[Tuple[bytearray, Tuple[str, int]]]] = deque()
+        self.deferring: Optional[bool] = None
+
+        self.bundle_endpoint: Optional[Tuple[str, int]] = None
+        self.bundle_count = 0
+        if bundle_mtu is not None:
+            bundle_size = bundle_mtu - UDP_OVERHEAD
+            self.bundles = [bytearray(bundle_size) for _ in range(JACK_SEND_BATCH)]
+            self.bundle_views = [memoryview(bundle) for bundle in self.bundles]
+            self.bundle_lengths = [0] * JACK_SEND_BATCH
+            self.bundle_endpoint = self.allocate_endpoint()
+
+    @property
+    def load(self) -> float:
+        """Bits per second sent from this server, which is balanced across a module's interfaces.
+        This is measured over the last ``load_window`` seconds, so that suppressed, compact and
+        compressed streams count for what they actually send, plus the nominal rate of the jacks
+        added since, which have not been measured yet.
+        """
+        return self.measured_load + self.added_load
+
+    def add_load(self, rate: float) -> None:
+        """Counts the nominal bit rate of a jack added to the server until it is measured"""
+        self.added_load += rate
 
-    def datagram_send(self, data: bytes):
-        self.sock.sendto(data, self.endpoint)
+    def measure_load(self) -> None:
+        now = self.transport.time()
+        elapsed = now - self.window_start
+        if elapsed < self.load_window:
+            return
+        self.measured_load = (self.stats.wire_bytes - self.window_bytes) * 8 / elapsed
+        self.window_start = now
+        self.window_bytes = self.stats.wire_bytes
+        self.added_load = 0.0
+
+    def allocate_endpoint(self, mult_addr: Optional[str] = None) -> Tuple[str, int]:
+        """Picks the multicast group and port that a new output jack sends to, which is shared by
+        all jacks when bundling
+        """
+        if mult_addr is None and self.bundle_endpoint is not None:
+            return self.bundle_endpoint
+
+        jack_addr = mult_addr or self.next_group()
+        endpoint = (jack_addr, JACK_PORT)
+        logging.info("Jack endpoint: " + str(endpoint) + " on " + self.address)
+        self.sock.join(jack_addr)
+        self.groups.add(jack_addr)
+        return endpoint
+
+    def next_group(self) -> str:
+        """Derives the next group from the interface address and a counter starting at a hash of
+        the module's id (for instance, 10.0.42.69 => 239.42.69.22, 239.42.69.23, ...), so that a
+        module with a fixed id sends to the same groups every time it starts, hosts on a /16
+        network never share one and modules on the same host rarely do. Groups that another
+        module was found sending to are skipped.
+        """
+        _, _, high, low = self.address.split(".")
+        prefix = SSM_PREFIX if self.source_specific else ASM_PREFIX
+        for _ in range(256):
+            self.group_index = self.group_index % 255 + 1
+            group = f"{prefix}.{high}.{low}.{self.group_index}"
+            if group not in self.groups and group not in self.collided:
+                return group
+        raise RuntimeError(f"No free multicast group left for {self.address}")
+
+    def reallocate(self, endpoint: Tuple[str, int]) -> Tuple[str, int]:
+        """Moves an endpoint to a new group after another module was found sending to the same
+        one, returning the new endpoint. The jacks sending to it have to be moved as well.
+        """
+        group = endpoint[0]
+        self.collided.add(group)
+        self.groups.discard(group)
+        self.sock.leave(group)
+        if endpoint != self.bundle_endpoint:
+            return self.allocate_endpoint()
+        self.bundle_endpoint = None
+        self.bundle_endpoint = self.allocate_endpoint()
+        return self.bundle_endpoint
+
+    def allocate_stream(self, endpoint: Tuple[str, int]) -> int:
+        """Picks the stream id of a new output jack sending to ``endpoint``. Unbundled jacks use
+        their group address and bundled jacks a random id that is unique within the module.
+        """
+        if endpoint != self.bundle_endpoint:
+            return self.parser.stream_id(endpoint[0])
+        while (stream := self.transport.rng.getrandbits(32)) in self.streams:
+            pass
+        self.streams.add(stream)
+        return stream
+
+    def datagram_send(self, data: bytearray, endpoint: Tuple[str, int]) -> None:
+        """Queues a datagram to be sent on the next ``flush``. The data is not copied, so the
+        buffer must not be modified until then, unless it is sent to the bundle endpoint, in which
+        case it is copied into the current bundle straight away. Frames too large for a bundle are
+        sent on their own.
+        """
+        self.stats.blocks += 1
+        if endpoint == self.bundle_endpoint and len(data) <= len(self.bundles[0]):
+            self.bundle_add(data)
+            return
+        if self.batch.is_full():
+            self.send_batch()
+        self.batch.add(data, endpoint)
+
+    def bundle_add(self, data: bytearray) -> None:
+        size = len(data)
+        length = self.bundle_lengths[self.bundle_count - 1] if self.bundle_count else 0
+        if self.bundle_count == 0 or length + size > len(self.bundles[0]):
+            if self.bundle_count == len(self.bundles):
+                self.flush()
+            self.bundle_count += 1
+            length = 0
+        index = self.bundle_count - 1
+        end = length + size
+        self.bundles[index][length:end] = data
+        self.bundle_lengths[index] = end
+
+    def flush(self) -> None:
+        """Sends all queued datagrams, or holds them back if pacing does not allow it yet"""
+        for index in range(self.bundle_count):
+            if self.batch.is_full():
+                self.send_batch()
+            bundle = self.bundle_views[index][: self.bundle_lengths[index]]
+            self.batch.add(bundle, self.bundle_endpoint)
+        self.send_batch()
+        self.bundle_count = 0
+        self.deferring = None
+        self.measure_load()
+
+    def pace(self) -> None:
+        """Refills the token bucket and sends the held back flushes that it allows. This should be
+        called between flushes, as often as the module is updated.
+        """
+        if self.pacing_rate is None:
+            return
+        now = self.transport.time()
+        self.tokens += (now - self.last_pace) * self.pacing_rate
+        self.tokens = min(self.tokens, self.pacing_burst)
+        self.last_pace = now
+        while self.deferred and self.tokens >= 1:
+            for data, endpoint in self.deferred.popleft():
+                if self.released.is_full():
+                    self.transmit_batch(self.released)
+                self.released.add(data, endpoint)
+            self.transmit_batch(self.released)
+            self.tokens -= 1
+
+    def next_send_time(self) -> Optional[float]:
+        """Local time at which the next held back flush may be sent, or ``None`` if there is
+        none
+        """
+        if not self.deferred:
+            return None
+        return self.last_pace + max(1 - self.tokens, 0) / self.pacing_rate
+
+    def send_batch(self) -> None:
+        if len(self.batch) == 0:
+            return
+        if self.deferring is None and self.pacing_rate is not None:
+            self.pace()
+            self.deferring = bool(self.deferred) or self.tokens < 1
+            if self.deferring:
+                if not self.deferred:
+                    self.stats.bursts += 1
+                self.deferred.append([])
+                self.stats.paced += 1
+            else:
+                self.tokens -= 1
+        if self.deferring:
+            self.deferred[-1].extend(
+                (bytearray(data), endpoint)
+                for data, endpoint in zip(self.batch.buffers, self.batch.addresses)
+            )
+            self.batch.clear()
+            return
+        self.transmit_batch(self.batch)
+
+    def transmit_batch(self, batch: MessageBatch) -> None:
+        packets = len(batch)
+        for buffer in batch.buffers:
+            self.stats.wire_bytes += len(buffer) + UDP_OVERHEAD
+        syscalls = self.sock.send_batch(batch)
+        self.stats.packets += packets
+        self.stats.syscalls += syscalls
+        self.stats.syscalls_saved += packets - syscalls
 
 
 class PatchServer:
-    def __init__(self, uuid, bind_addr) -> None:
+    def __init__(self, uuid, bind_addr, transport: Optional[Transport] = None) -> None:
         self.uuid = uuid
         self.parser = MessageParser()
+        self.transport = transport or UdpTransport()
 
         # The socket allows address reuse, which may be a security concern. However, we are
         # exclusively looking at UDP multicasts in this protocol.
 
-        self.sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind((bind_addr, PATCH_PORT))
-        self.sock.setsockopt(
-            socket.IPPROTO_IP,
-            socket.IP_ADD_MEMBERSHIP,
-            socket.inet_aton(PATCH_ADDR) + socket.inet_aton(bind_addr),
-        )
-        self.sock.setblocking(False)
+        self.sock = self.transport.open(bind_addr, PATCH_PORT, bind=bind_addr)
+        self.sock.join(PATCH_ADDR)
 
     def get_data(self) -> bytes:
         data = b""
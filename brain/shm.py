@@ -0,0 +1,99 @@
+# When an output and an input jack live on the same host, the blocks can skip the network stack
+# entirely. The output jack writes each datagram (header and samples, exactly as it would be sent)
+# into a ring of slots in a shared memory segment and then bumps a block counter at the start of
+# the segment. Readers poll the counter and copy out every slot written since their last poll.
+
+import numpy as np
+import os
+import secrets
+import socket
+import uuid
+import weakref
+
+from multiprocessing import shared_memory
+from typing import Callable, Final, Set
+
+from .constants import JACK_RING_SIZE
+
+#: Identifies the machine so that jacks can tell whether their peer is on the same host
+HOST_ID: Final = f"{socket.gethostname()}:{uuid.getnode():012x}"
+
+# Names of the segments created by this process
+_created: Set[str] = set()
+
+
+class SharedBlockWriter:
+    """Publishes the datagrams of an output jack in a new shared memory segment
+
+    :param frame_size: Size in bytes of each datagram
+    """
+
+    def __init__(self, frame_size: int):
+        self.shm = shared_memory.SharedMemory(
+            name="brain_" + secrets.token_hex(8),
+            create=True,
+            size=8 + JACK_RING_SIZE * frame_size,
+        )
+        self.name = self.shm.name
+        _created.add(self.name)
+        self.counter = np.ndarray((1,), dtype=np.uint64, buffer=self.shm.buf)
+        self.frames = np.ndarray(
+            (JACK_RING_SIZE, frame_size), dtype=np.uint8, buffer=self.shm.buf, offset=8
+        )
+        self.counter[0] = 0
+        # Remove the segment name once the writer is gone or the interpreter exits
+        self.unlink = weakref.finalize(self, self.shm.unlink)
+
+    def write(self, frame: np.ndarray) -> None:
+        """Copies a datagram into the next slot and then publishes it"""
+        count = int(self.counter[0])
+        self.frames[count % JACK_RING_SIZE] = frame
+        self.counter[0] = count + 1
+
+    def close(self) -> None:
+        self.unlink()
+        del self.counter, self.frames
+        self.shm.close()
+
+
+class SharedBlockReader:
+    """Reads the datagrams published by a ``SharedBlockWriter``, starting with the next one written
+
+    :param name: Name of the shared memory segment
+
+    :param frame_size: Size in bytes of each datagram
+    """
+
+    def __init__(self, name: str, frame_size: int):
+        self.shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix" and name not in _created:
+            # Attaching registers the segment with the resource tracker, which would otherwise
+            # unlink it when this process exits even though the writer still owns it.
+            from multiprocessing import resource_tracker
+
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.counter = np.ndarray((1,), dtype=np.uint64, buffer=self.shm.buf)
+        self.frames = np.ndarray(
+            (JACK_RING_SIZE, frame_size), dtype=np.uint8, buffer=self.shm.buf, offset=8
+        )
+        self.slots = [memoryview(frame) for frame in self.frames]
+        self.read_count = int(self.counter[0])
+
+    def poll(self, callback: Callable[[memoryview, int], None]) -> int:
+        """Calls ``callback`` with each slot written since the last poll and its length. If the
+        writer has lapped the reader, the blocks that were overwritten are skipped.
+
+        :return: The number of blocks read
+        """
+        count = int(self.counter[0])
+        self.read_count = max(self.read_count, count - JACK_RING_SIZE)
+        read = count - self.read_count
+        for index in range(self.read_count, count):
+            slot = self.slots[index % JACK_RING_SIZE]
+            callback(slot, slot.nbytes)
+        self.read_count = count
+        return read
+
+    def close(self) -> None:
+        del self.counter, self.frames, self.slots
+        self.shm.close()
@@ -0,0 +1,126 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class JackStats:
+    """Running counters describing the traffic seen by a jack"""
+
+    #: Blocks sent to the network
+    sent: int = 0
+    #: Blocks not sent because no input jacks were connected
+    suppressed: int = 0
+    #: Blocks accepted from the network
+    received: int = 0
+    #: Datagrams discarded because the header or length did not match the expected format
+    rejected: int = 0
+    #: Blocks that had not arrived by the time they were due to be played out
+    lost: int = 0
+    #: Blocks that arrived after they were due or duplicated and were discarded
+    reordered: int = 0
+    #: Blocks discarded by the jitter buffer to keep latency within its limits
+    dropped: int = 0
+    #: Number of times the jitter buffer ran empty and had to refill before playing again
+    underruns: int = 0
+    #: Parity blocks sent or received for forward error correction, an overhead of one block per
+    #: group of blocks protected
+    parity: int = 0
+    #: Blocks rebuilt from parity when they were due to be played but had not arrived
+    recovered: int = 0
+    #: Datagrams sent by unicast to each subscribing module instead of to the multicast group
+    unicast: int = 0
+    #: Blocks sent or received as compact frames, because they held the same value throughout
+    #: each channel or repeated the previous block
+    compact: int = 0
+    #: Blocks sent or received compressed by the jack's codec
+    compressed: int = 0
+    #: Ratio of the size of the blocks sent or received once the codec was in use to their size
+    #: on the network
+    compression: float = 1.0
+    #: Average time in seconds taken by the codec to encode or decode a block
+    codec_time: float = 0.0
+    #: Blocks made up by the jack's concealment while patched, because the next block of the
+    #: stream was lost, late or still buffering
+    concealed: int = 0
+    #: Current number of blocks between the newest received block and the next one played
+    depth: int = 0
+    #: Number of blocks the jitter buffer is currently aiming to hold
+    target_depth: int = 0
+    #: Smoothed estimate of the packet inter-arrival jitter in samples
+    jitter: float = 0
+    #: Estimated ratio of the sample rate of the stream to that of the receiving module, if the
+    #: input jack resamples
+    rate_ratio: float = 1.0
+
+
+@dataclass
+class SenderStats:
+    """Running counters describing the datagrams sent by a module's output jacks"""
+
+    #: Blocks sent
+    blocks: int = 0
+    #: Datagrams sent, fewer than ``blocks`` when blocks are bundled
+    packets: int = 0
+    #: Bytes sent, including IP and UDP headers
+    wire_bytes: int = 0
+    #: System calls used to send them
+    syscalls: int = 0
+    #: System calls avoided by sending datagrams in batches rather than one at a time
+    syscalls_saved: int = 0
+    #: Bursts of flushes smoothed out by pacing, for instance when a module catches up on
+    #: missed blocks
+    bursts: int = 0
+    #: Flushes whose datagrams were held back by pacing and sent later
+    paced: int = 0
+
+
+@dataclass
+class SchedulerStats:
+    """Running measurements of how closely ``Module.run`` wakes up on its block deadlines. Times
+    are in seconds.
+    """
+
+    #: Number of wakeups
+    wakeups: int = 0
+    #: Time between the deadline and the last wakeup
+    lateness: float = 0
+    #: Largest lateness seen
+    max_lateness: float = 0
+    #: Mean lateness over all wakeups
+    mean_lateness: float = 0
+    #: Wakeups more than a block period late, after which the missed blocks are processed
+    #: back to back to catch up
+    missed: int = 0
+
+
+@dataclass
+class ClockStats:
+    """State of a module's network clock relative to the leader. Times are in seconds."""
+
+    #: Whether the clock has been set from the leader at least once
+    synchronized: bool = False
+    #: Error measured by the last accepted exchange, positive if this clock was ahead
+    error: float = 0
+    #: One-way delay to the leader measured by the last accepted exchange
+    delay: float = 0
+    #: Rate correction applied to the local clock, in seconds per second
+    drift: float = 0
+    #: Number of times the clock was stepped rather than slewed
+    steps: int = 0
+    #: Exchanges discarded because their round trip was much slower than recent ones
+    discarded: int = 0
+
+
+@dataclass
+class LinkStats:
+    """Running counters describing the datagrams carried by a link of an emulated network"""
+
+    #: Datagrams offered to the link
+    sent: int = 0
+    #: Datagrams lost at random
+    lost: int = 0
+    #: Datagrams dropped because they would have queued for too long behind the bandwidth cap
+    dropped: int = 0
+    #: Datagrams held back so that later ones overtake them
+    reordered: int = 0
+    #: Bytes of the datagrams delivered
+    delivered_bytes: int = 0
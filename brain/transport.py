@@ -0,0 +1,236 @@
+# The servers send and receive all of their traffic through a ``Transport``, which hands out
+# non-blocking datagram sockets and provides the clock and random source that go with them. The
+# default ``UdpTransport`` uses real sockets on the host's interfaces, while ``brain.emulator``
+# provides an in-memory network with a virtual clock for reproducible experiments.
+
+import ctypes
+import ctypes.util
+import errno
+import netifaces
+import random
+import socket
+import sys
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+from .constants import SCHEDULER_SPIN_TIME
+from .mmsg import MessageBatch
+
+#: Linux socket option, not exposed by the ``socket`` module
+IP_MULTICAST_ALL = 49
+
+#: Socket options for source-specific joins, with their Linux values where the ``socket`` module
+#: does not expose them
+IP_ADD_SOURCE_MEMBERSHIP = getattr(socket, "IP_ADD_SOURCE_MEMBERSHIP", 39)
+IP_DROP_SOURCE_MEMBERSHIP = getattr(socket, "IP_DROP_SOURCE_MEMBERSHIP", 40)
+
+#: Linux clock and flag for an absolute ``clock_nanosleep`` on the clock behind ``perf_counter``
+CLOCK_MONOTONIC = 1
+TIMER_ABSTIME = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def _load_clock_nanosleep():
+    # Python has no binding for clock_nanosleep, and sleeping to an absolute deadline only lines
+    # up with the scheduler's deadlines if perf_counter reads the same clock
+    implementation = time.get_clock_info("perf_counter").implementation
+    if not sys.platform.startswith("linux") or "CLOCK_MONOTONIC)" not in implementation:
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"))
+        clock_nanosleep = libc.clock_nanosleep
+    except (OSError, AttributeError):
+        return None
+    clock_nanosleep.argtypes = [
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.POINTER(_timespec),
+        ctypes.POINTER(_timespec),
+    ]
+    clock_nanosleep.restype = ctypes.c_int
+    return clock_nanosleep
+
+
+_clock_nanosleep = _load_clock_nanosleep()
+
+
+class DatagramSocket:
+    """A datagram socket opened on one interface by a ``Transport``. Sockets opened with a port
+    are non-blocking and raise ``BlockingIOError`` when no datagram is pending.
+    """
+
+    def join(self, group: str, source: Optional[str] = None) -> None:
+        """Starts receiving datagrams sent to the multicast group ``group``, only from the host at
+        ``source`` if it is given
+        """
+        raise NotImplementedError
+
+    def leave(self, group: str, source: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def local_port(self) -> int:
+        """Port the socket receives on, which was picked by the system if it was opened with
+        port 0
+        """
+        raise NotImplementedError
+
+    def recv(self, bufsize: int) -> bytes:
+        raise NotImplementedError
+
+    def recv_into(self, buffer: memoryview) -> int:
+        raise NotImplementedError
+
+    def sendto(self, data: bytes, address: Tuple[str, int]) -> None:
+        raise NotImplementedError
+
+    def send_batch(self, batch: MessageBatch) -> int:
+        """Sends every datagram in ``batch`` and empties it.
+
+        :return: The number of system calls used
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+
+class Transport:
+    """Creates the sockets used by a module and keeps its time
+
+    :param rng: Source of randomness for timeouts and address allocation
+    """
+
+    #: Whether jacks on the same host or in the same interpreter may bypass the transport and
+    #: exchange blocks through shared memory or directly
+    shortcuts = False
+
+    def __init__(self, rng: Optional[random.Random] = None):
+        self.rng = rng or random.Random()
+
+    def interfaces(self) -> List[Dict[str, str]]:
+        """Lists the ip4 addresses of the available interfaces, as the ``AF_INET`` entries of
+        ``netifaces.ifaddresses``
+        """
+        raise NotImplementedError
+
+    def open(
+        self, address: str, port: Optional[int] = None, bind: str = ""
+    ) -> DatagramSocket:
+        """Opens a socket sending from the interface at ``address``
+
+        :param port: Port to receive on. Without a port, the socket is only used for sending.
+
+        :param bind: Address to bind to when receiving, by default all of them
+        """
+        raise NotImplementedError
+
+    def time(self) -> float:
+        """Current time in seconds, only meaningful relative to other values of ``time``"""
+        raise NotImplementedError
+
+    def wait_until(self, deadline: float) -> None:
+        """Blocks until ``time`` reaches ``deadline``, returning immediately if it already has"""
+        raise NotImplementedError
+
+
+class UdpSocket(DatagramSocket):
+    def __init__(self, address: str, port: Optional[int] = None, bind: str = ""):
+        self.address = address
+        self.sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(
+            socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(address)
+        )
+        if port is not None:
+            if sys.platform.startswith("linux"):
+                # Only deliver the groups joined on this socket rather than every group joined by
+                # any process on the host
+                self.sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+            self.sock.bind((bind, port))
+            self.sock.setblocking(False)
+
+    def membership(self, group: str, source: Optional[str] = None) -> bytes:
+        """Packs an ``ip_mreq``, or an ``ip_mreq_source`` if ``source`` is given, whose fields
+        are ordered differently on Linux and the BSDs
+        """
+        request = socket.inet_aton(group) + socket.inet_aton(self.address)
+        if source is None:
+            return request
+        if sys.platform.startswith("linux"):
+            return request + socket.inet_aton(source)
+        return socket.inet_aton(group) + socket.inet_aton(source) + request[4:]
+
+    def join(self, group: str, source: Optional[str] = None) -> None:
+        option = socket.IP_ADD_MEMBERSHIP
+        if source is not None:
+            option = IP_ADD_SOURCE_MEMBERSHIP
+        self.sock.setsockopt(socket.IPPROTO_IP, option, self.membership(group, source))
+
+    def leave(self, group: str, source: Optional[str] = None) -> None:
+        option = socket.IP_DROP_MEMBERSHIP
+        if source is not None:
+            option = IP_DROP_SOURCE_MEMBERSHIP
+        self.sock.setsockopt(socket.IPPROTO_IP, option, self.membership(group, source))
+
+    def local_port(self) -> int:
+        return self.sock.getsockname()[1]
+
+    def recv(self, bufsize: int) -> bytes:
+        return self.sock.recv(bufsize)
+
+    def recv_into(self, buffer: memoryview) -> int:
+        return self.sock.recv_into(buffer)
+
+    def sendto(self, data: bytes, address: Tuple[str, int]) -> None:
+        self.sock.sendto(data, address)
+
+    def send_batch(self, batch: MessageBatch) -> int:
+        return batch.send(self.sock)
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class UdpTransport(Transport):
+    """Sends datagrams over the host's network interfaces"""
+
+    shortcuts = True
+
+    def interfaces(self) -> List[Dict[str, str]]:
+        addresses = []
+        for interface in netifaces.interfaces():
+            interfaces_details = netifaces.ifaddresses(interface)
+            if netifaces.AF_INET in interfaces_details:
+                addresses.extend(interfaces_details[netifaces.AF_INET])
+        return addresses
+
+    def open(
+        self, address: str, port: Optional[int] = None, bind: str = ""
+    ) -> UdpSocket:
+        return UdpSocket(address, port, bind)
+
+    def time(self) -> float:
+        return time.perf_counter()
+
+    def wait_until(self, deadline: float) -> None:
+        # Sleep until shortly before the deadline and spin for the rest, since the sleep alone can
+        # overshoot by a timer slack or a scheduler quantum. On Linux the sleep is to an absolute
+        # time, so time spent getting to sleep does not push the wakeup back.
+        wakeup = deadline - SCHEDULER_SPIN_TIME
+        if _clock_nanosleep is not None:
+            seconds = int(wakeup)
+            request = _timespec(seconds, int((wakeup - seconds) * 1e9))
+            while (
+                wakeup > time.perf_counter()
+                and _clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, request, None)
+                == errno.EINTR
+            ):
+                pass
+        elif (remaining := wakeup - time.perf_counter()) > 0:
+            time.sleep(remaining)
+        while time.perf_counter() < deadline:
+            pass
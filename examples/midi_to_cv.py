@@ -48,12 +48,24 @@ class MidiToCV(brain.EventHandler):
         self.voices = [Voice(0, False, 0) for _ in range(brain.CHANNELS)]
         self.mod_wheel = 0
 
-        self.note_jack = self.mod.add_output(name="Note", color=self.color)
-        self.gate_jack = self.mod.add_output(name="Gate", color=self.color)
-        self.velo_jack = self.mod.add_output(name="Velocity", color=self.color)
-        self.lift_jack = self.mod.add_output(name="Lift", color=self.color)
-        self.piwh_jack = self.mod.add_output(name="Pitch Wheel", color=self.color)
-        self.mdwh_jack = self.mod.add_output(name="Mod Wheel", color=self.color)
+        self.note_jack = self.mod.add_output(
+            name="Note", color=self.color, compact=True
+        )
+        self.gate_jack = self.mod.add_output(
+            name="Gate", color=self.color, compact=True
+        )
+        self.velo_jack = self.mod.add_output(
+            name="Velocity", color=self.color, compact=True
+        )
+        self.lift_jack = self.mod.add_output(
+            name="Lift", color=self.color, compact=True
+        )
+        self.piwh_jack = self.mod.add_output(
+            name="Pitch Wheel", color=self.color, compact=True
+        )
+        self.mdwh_jack = self.mod.add_output(
+            name="Mod Wheel", color=self.color, compact=True
+        )
 
         self.ui_setup()
         self.loop.create_task(self.ui_task())
@@ -0,0 +1,434 @@
+import numpy as np
+import pytest
+
+from brain import BLOCK_SIZE, CHANNELS, EventHandler, Module, PatchState, SAMPLE_TYPE
+from brain.emulator import EmulatedNetwork, LinkProfile
+from brain.constants import JACK_PORT
+from brain.protocol import PatchConnection, SnapshotResponse
+from brain.servers import InputJackListener, OutputJackServer
+from brain.transport import UdpTransport
+
+
+class Counter(EventHandler):
+    """Outputs a block filled with the number of blocks processed so far"""
+
+    def __init__(self, block_size=BLOCK_SIZE, outputs=1):
+        self.block_size = block_size
+        self.outputs = outputs
+        self.count = 0
+
+    def process(self, input):
+        self.count += 1
+        shape = (self.outputs, self.block_size, CHANNELS)
+        return np.full(shape, self.count, dtype=SAMPLE_TYPE)
+
+
+def patch_modules(network, block_size=BLOCK_SIZE, fec=None):
+    mod0 = Module(
+        "test0",
+        Counter(block_size),
+        id="test0",
+        transport=network.host("10.0.0.1"),
+        block_size=block_size,
+    )
+    mod1 = Module("test1", id="test1", transport=network.host("10.0.0.2"))
+    output = mod0.add_output("output0", 0, fec=fec)
+    input = mod1.add_input("input0")
+    patch(network, mod0, mod1, output, input)
+    return mod0, mod1, output, input
+
+
+def patch(network, mod0, mod1, output, input):
+    network.run([mod0, mod1], 1.0)
+    toggle_patch(network, mod0, mod1, output, input)
+    assert mod0.is_patched(output) and mod1.is_patched(input)
+
+
+def toggle_patch(network, mod0, mod1, output, input):
+    mod0.set_patch_enabled(output, True)
+    network.run([mod0, mod1], 0.2)
+    assert mod1.get_patch_state() == PatchState.PATCH_ENABLED
+    mod1.set_patch_enabled(input, True)
+    network.run([mod0, mod1], 0.2)
+    assert mod1.get_patch_state() == PatchState.PATCH_TOGGLED
+    mod0.set_patch_enabled(output, False)
+    mod1.set_patch_enabled(input, False)
+    network.run([mod0, mod1], 0.2)
+
+
+def test_emulated_modules_patch():
+    network = EmulatedNetwork(seed=1)
+    mod0, mod1, output, input = patch_modules(network)
+    network.run([mod0, mod1], 0.5)
+    assert mod1.get_jack_stats(input).received > 400
+    assert mod1.get_jack_stats(input).lost == 0
+    assert input.get_data()[0, 0] > 0
+
+
+def test_inputs_share_a_stream():
+    network = EmulatedNetwork()
+    mod0, mod1, output, input = patch_modules(network)
+    other = mod1.add_input("input1")
+    toggle_patch(network, mod0, mod1, output, other)
+    received = mod1.get_jack_stats(input).received
+    network.run([mod0, mod1], 0.5)
+    assert mod1.get_jack_stats(input).received > received + 400
+    assert mod1.get_jack_stats(other).received > 400
+
+    # Unpatching one input leaves the other receiving
+    toggle_patch(network, mod0, mod1, output, input)
+    assert not mod1.is_patched(input) and mod1.is_patched(other)
+    received = mod1.get_jack_stats(other).received
+    network.run([mod0, mod1], 0.5)
+    assert mod1.get_jack_stats(other).received > received + 400
+
+
+def test_module_without_interfaces():
+    transport = EmulatedNetwork().host("10.0.0.1")
+    transport.interfaces = lambda: []
+    module = Module("test0", id="test0", transport=transport)
+    input = module.add_input("input0")
+    assert input.get_data().shape == (BLOCK_SIZE, CHANNELS)
+    with pytest.raises(RuntimeError):
+        module.add_output("output0", 0)
+
+
+def test_jacks_spread_across_interfaces():
+    network = EmulatedNetwork()
+    mod0, mod1 = [
+        Module(
+            f"test{i}",
+            Counter(outputs=4),
+            id=f"test{i}",
+            transport=network.host(
+                f"10.0.0.{i + 1}", extra_addresses=[f"10.0.1.{i + 1}"]
+            ),
+            jack_interfaces=[f"10.0.1.{i + 1}"],
+        )
+        for i in range(2)
+    ]
+    outputs = [mod0.add_output(f"output{i}", 0) for i in range(4)]
+    servers = [output.jack_server for output in outputs]
+    assert servers == mod0.jack_servers * 2
+    input = mod1.add_input("input0")
+    patch(network, mod0, mod1, outputs[1], input)
+    network.run([mod0, mod1], 0.5)
+    assert mod1.get_jack_stats(input).received > 400
+    assert input.listener is mod1.jack_listeners[1]
+    assert network.link("10.0.1.1", "10.0.1.2").stats.sent > 400
+    assert ("10.0.0.1", "10.0.1.2") not in network.links
+
+
+def test_outputs_go_to_least_used_interface():
+    network = EmulatedNetwork()
+    mod0, mod1 = [
+        Module(
+            f"test{i}",
+            Counter(outputs=2),
+            id=f"test{i}",
+            transport=network.host(
+                f"10.0.0.{i + 1}", extra_addresses=[f"10.0.1.{i + 1}"]
+            ),
+            jack_interfaces=[f"10.0.1.{i + 1}"],
+        )
+        for i in range(2)
+    ]
+    outputs = [mod0.add_output(f"output{i}", 0) for i in range(2)]
+    input = mod1.add_input("input0")
+    patch(network, mod0, mod1, outputs[0], input)
+    network.run([mod0, mod1], 1.0)
+    # Both interfaces have one output, but only the patched one sends its full stream
+    primary, extra = mod0.jack_servers
+    assert primary.load > 10 * extra.load
+    assert mod0.add_output("output2", 0).jack_server is extra
+
+
+def test_output_groups_follow_interface_address():
+    network = EmulatedNetwork()
+    module = Module("test0", id="test0", transport=network.host("10.0.42.69"))
+    outputs = [module.add_output(f"output{i}", 0) for i in range(2)]
+    assert [output.endpoint[0] for output in outputs] == [
+        "239.42.69.22",
+        "239.42.69.23",
+    ]
+
+
+def test_modules_on_one_host_use_different_groups():
+    network = EmulatedNetwork()
+    modules = [
+        Module(
+            f"test{i}",
+            Counter(outputs=3),
+            id=f"test{i}",
+            transport=network.host("10.0.0.1"),
+        )
+        for i in range(2)
+    ]
+    groups = [
+        {module.add_output(f"output{i}", 0).endpoint[0] for i in range(3)}
+        for module in modules
+    ]
+    assert not groups[0] & groups[1]
+    network.run(modules, 1.0)
+    assert [
+        {jack.endpoint[0] for jack in module.outputs.values()} for module in modules
+    ] == groups
+
+
+def test_source_specific_inputs_ignore_other_senders():
+    network = EmulatedNetwork()
+    mod0 = Module(
+        "test0",
+        Counter(),
+        id="test0",
+        transport=network.host("10.0.0.1"),
+        source_specific=True,
+    )
+    mod1 = Module("test1", id="test1", transport=network.host("10.0.0.2"))
+    output = mod0.add_output("output0", 0)
+    input = mod1.add_input("input0")
+    patch(network, mod0, mod1, output, input)
+    assert output.endpoint[0] == "232.0.1.22"
+    assert mod1.jack_listener.group_sources[output.endpoint[0]] == "10.0.0.1"
+
+    rogue = network.host("10.0.0.3").open("10.0.0.3")
+    rogue.sendto(bytes(100), output.endpoint)
+    network.run([mod0, mod1], 0.5)
+    assert mod1.get_jack_stats(input).received > 400
+    assert ("10.0.0.3", "10.0.0.2") not in network.links
+
+
+def test_outputs_switch_from_unicast_to_multicast():
+    network = EmulatedNetwork()
+    mod0 = Module(
+        "test0",
+        Counter(),
+        id="test0",
+        transport=network.host("10.0.0.1"),
+        unicast_limit=1,
+    )
+    mod1, mod2 = [
+        Module(f"test{i}", id=f"test{i}", transport=network.host(f"10.0.0.{i + 1}"))
+        for i in (1, 2)
+    ]
+    modules = [mod0, mod1, mod2]
+    output = mod0.add_output("output0", 0)
+    inputs = [mod1.add_input("input0"), mod2.add_input("input0")]
+    network.run(modules, 1.0)
+    for module, input in zip(modules[1:], inputs):
+        mod0.set_patch_enabled(output, True)
+        network.run(modules, 0.2)
+        module.set_patch_enabled(input, True)
+        network.run(modules, 0.2)
+        mod0.set_patch_enabled(output, False)
+        module.set_patch_enabled(input, False)
+        network.run(modules, 0.5)
+        if module is mod1:
+            assert output.targets == [
+                (mod1.jack_listener.address, mod1.jack_listener.unicast_port)
+            ]
+            assert output.get_stats().unicast > 400
+    assert output.targets == [output.endpoint]
+    unicast = output.get_stats().unicast
+    network.run(modules, 0.5)
+    assert output.get_stats().unicast == unicast
+    assert mod1.get_jack_stats(inputs[0]).lost == 0
+    assert mod2.get_jack_stats(inputs[1]).received > 400
+
+
+def test_preset_restores_unicast_patch():
+    network = EmulatedNetwork()
+    mod0, mod1, output, input = patch_modules(network)
+    endpoint = (mod1.jack_listener.address, mod1.jack_listener.unicast_port)
+    assert output.targets == [endpoint]
+    output.clear()
+    input.clear()
+
+    patched = [PatchConnection("test1", input.id, "test0", output.id)]
+    snapshots = [
+        SnapshotResponse(uuid=module.uuid, data="", patched=patched).to_json()
+        for module in (mod0, mod1)
+    ]
+    mod0.set_all_snapshots(snapshots)
+    network.run([mod0, mod1], 0.5)
+    assert mod1.is_patched(input) and output.targets == [endpoint]
+    received = mod1.get_jack_stats(input).received
+    network.run([mod0, mod1], 0.5)
+    assert mod1.get_jack_stats(input).received > received + 400
+
+
+def test_colliding_groups_are_moved():
+    network = EmulatedNetwork()
+    mod0, mod1, output, input = patch_modules(network)
+    group = output.endpoint[0]
+    # A module started later on the same address that happens to allocate the same group keeps
+    # it, since its uuid sorts first
+    mod2 = Module("test", Counter(), id="test", transport=network.host("10.0.0.1"))
+    mod2.jack_server.group_index = mod0.jack_server.group_index - 1
+    other = mod2.add_output("output0", 0)
+    assert other.endpoint[0] == group
+    network.run([mod0, mod1, mod2], 1.0)
+    assert other.endpoint[0] == group and output.endpoint[0] != group
+    assert input.connected_addr == output.endpoint[0]
+    received = mod1.get_jack_stats(input).received
+    network.run([mod0, mod1, mod2], 0.5)
+    assert mod1.get_jack_stats(input).received > received + 400
+
+
+def test_emulated_modules_reblock():
+    network = EmulatedNetwork()
+    mod0, mod1, output, input = patch_modules(network, block_size=4 * BLOCK_SIZE)
+    network.run([mod0, mod1], 0.5)
+    assert mod1.get_jack_stats(input).received > 100
+    assert mod1.get_jack_stats(input).lost == 0
+    assert input.get_data()[0, 0] > 0
+
+
+def test_emulated_network_is_reproducible():
+    stats = []
+    for _ in range(2):
+        network = EmulatedNetwork(seed=2)
+        mod0, mod1, output, input = patch_modules(network)
+        profile = LinkProfile(latency=0.002, jitter=0.001, loss=0.02)
+        network.set_link("10.0.0.1", "10.0.0.2", profile)
+        network.run([mod0, mod1], 1.0)
+        stats.append(mod1.get_jack_stats(input))
+        assert network.stats().lost > 0
+    assert stats[0] == stats[1]
+    assert stats[0].lost > 0
+
+
+def test_parity_rebuilds_lost_blocks():
+    lost = []
+    for fec in (None, 4):
+        network = EmulatedNetwork(seed=3)
+        mod0, mod1, output, input = patch_modules(network, fec=fec)
+        profile = LinkProfile(latency=0.002, jitter=0.001, loss=0.02)
+        network.set_link("10.0.0.1", "10.0.0.2", profile)
+        network.run([mod0, mod1], 2.0)
+        stats = mod1.get_jack_stats(input)
+        lost.append(stats.lost)
+    assert mod0.get_jack_stats(output).parity == mod0.get_jack_stats(output).sent // 4
+    assert stats.parity > 0 and stats.recovered > 0
+    assert lost[1] < lost[0] / 2
+
+
+def test_run_wakes_on_block_deadlines():
+    network = EmulatedNetwork()
+    module = Module("test0", Counter(), id="test0", transport=network.host("10.0.0.1"))
+    module.run(duration=0.1)
+    stats = module.get_scheduler_stats()
+    assert 99 <= stats.wakeups <= 100
+    assert stats.max_lateness == 0 and stats.missed == 0
+    assert module.event_handler.count == stats.wakeups
+    assert network.now == module.tick_time
+
+
+def test_modules_share_block_clock():
+    network = EmulatedNetwork(profile=LinkProfile(latency=0.0005, jitter=0.0003))
+    clocks = [(5.0, 0.0), (123.4, 50e-6), (77.7, -80e-6)]
+    modules = [
+        Module(
+            f"test{i}",
+            Counter(),
+            id=f"test{i}",
+            transport=network.host(f"10.0.0.{i + 1}", offset, drift),
+        )
+        for i, (offset, drift) in enumerate(clocks)
+    ]
+    network.run(modules, 3.0)
+    times = [module.clock.time() for module in modules]
+    assert max(times) - min(times) < 50e-6
+    assert len({module.sample_clock for module in modules}) == 1
+    assert sum(module.get_clock_stats().synchronized for module in modules) == 2
+
+
+def test_output_server_paces_bursts():
+    network = EmulatedNetwork()
+    server = OutputJackServer("10.0.0.1", network.host("10.0.0.1"), packet_rate=1000)
+    receiver = network.host("10.0.0.2").open("10.0.0.2", 5000)
+    frames = [bytearray([i]) for i in range(6)]
+    for frame in frames:
+        server.datagram_send(frame, ("10.0.0.2", 5000))
+        server.flush()
+    link = network.link("10.0.0.1", "10.0.0.2")
+    assert link.stats.sent == 2
+    assert server.stats.bursts == 1 and server.stats.paced == 4
+
+    # The rest follow at twice the packet rate
+    while server.next_send_time() is not None:
+        network.advance(server.next_send_time() - network.now)
+        server.pace()
+    assert abs(network.now - 0.002) < 1e-9
+    network.advance(0.01)
+    assert [receiver.recv(16)[0] for _ in frames] == list(range(6))
+
+
+def test_paced_flushes_keep_their_order():
+    network = EmulatedNetwork()
+    server = OutputJackServer("10.0.0.1", network.host("10.0.0.1"), packet_rate=1000)
+    receiver = network.host("10.0.0.2").open("10.0.0.2", 5000)
+    frames = [bytearray([i]) for i in range(4)]
+    for frame in frames[:3]:
+        server.datagram_send(frame, ("10.0.0.2", 5000))
+        server.flush()
+    # A token is available again, but the held back flush has to go out first
+    network.advance(0.0006)
+    server.datagram_send(frames[3], ("10.0.0.2", 5000))
+    server.flush()
+    assert list(server.deferred) == [[(frames[3], ("10.0.0.2", 5000))]]
+    while server.next_send_time() is not None:
+        network.advance(server.next_send_time() - network.now)
+        server.pace()
+    network.advance(0.01)
+    assert [receiver.recv(16)[0] for _ in frames] == list(range(4))
+
+
+def test_listener_pools_memberships():
+    network = EmulatedNetwork()
+    listener = InputJackListener("10.0.0.1", transport=network.host("10.0.0.1"))
+    groups = [f"239.0.0.{i}" for i in range(25)]
+    frames = []
+
+    def receive(frame, nbytes, arrival):
+        frames.append(bytes(frame[:nbytes]))
+
+    for group in groups:
+        listener.subscribe(group, JACK_PORT, receive)
+    assert len(listener.sockets) == 2
+    assert len(listener.sockets[0].groups) == InputJackListener.max_memberships
+
+    # Re-patching to a group that was just left finds it still joined
+    sock = listener.group_sockets[groups[0]]
+    listener.unsubscribe(groups[0], receive)
+    assert groups[0] in sock.groups
+    listener.subscribe(groups[0], JACK_PORT, receive)
+    assert listener.group_sockets[groups[0]] is sock and not listener.idle
+
+    for group in groups[:10]:
+        listener.unsubscribe(group, receive)
+    network.advance(InputJackListener.membership_linger)
+    listener.update()
+    assert sum(len(sock.groups) for sock in listener.sockets) == 15
+    assert not frames
+    listener.close()
+
+
+def test_udp_transport_waits_until_deadline():
+    transport = UdpTransport()
+    deadline = transport.time() + 0.002
+    transport.wait_until(deadline)
+    assert transport.time() >= deadline
+
+
+def test_emulated_bandwidth_limit():
+    network = EmulatedNetwork(profile=LinkProfile(bandwidth=1e6, queue_limit=0.01))
+    sender = network.host("10.0.0.1").open("10.0.0.1")
+    receiver = network.host("10.0.0.2").open("10.0.0.2", 5000)
+    for _ in range(100):
+        sender.sendto(bytes(1000), ("10.0.0.2", 5000))
+    link = network.link("10.0.0.1", "10.0.0.2")
+    # 1000 bytes take 8 ms at 1 Mb/s, so only one more datagram fits in the queue behind the first
+    assert link.stats.dropped == 98
+    network.advance(0.1)
+    assert len(receiver.recv(2048)) == 1000
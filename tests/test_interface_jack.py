@@ -0,0 +1,421 @@
+import numpy as np
+import socket
+
+from brain import Concealment, InputJack, OutputJack, SampleFormat
+from brain.buffers import JitterBuffer
+from brain.emulator import EmulatedNetwork
+from brain.formats import FULL_SCALE, SAMPLE_DTYPES
+from brain.constants import BLOCK_SIZE, CHANNELS, JACK_KEEPALIVE_INTERVAL, SAMPLE_TYPE
+from brain.jacks import local_inputs, local_outputs
+from brain.parsers import BlockParser
+from brain.servers import InputJackListener, OutputJackServer
+
+TEST_PORT = 19993
+TEST_GROUP = "239.0.0.1"
+
+
+def make_frame(block, sequence, group=TEST_GROUP):
+    parser = BlockParser(len(block))
+    header = bytearray(parser.header.size)
+    parser.create_header(
+        header, parser.stream_id(group), sequence, sequence * len(block)
+    )
+    return bytes(header) + block.tobytes()
+
+
+def send_frames(frames, port=TEST_PORT):
+    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    for frame in frames:
+        sock.sendto(frame, ("127.0.0.1", port))
+    sock.close()
+
+
+def send_blocks(blocks, group=TEST_GROUP, port=TEST_PORT):
+    send_frames([make_frame(b, i, group) for i, b in enumerate(blocks)], port)
+
+
+def make_block(value, block_size=BLOCK_SIZE):
+    return np.full((block_size, CHANNELS), value, dtype=SAMPLE_TYPE)
+
+
+def make_listener():
+    return InputJackListener("127.0.0.1", TEST_PORT)
+
+
+def test_input_jack_drains_backlog():
+    listener = make_listener()
+    jack = InputJack("input0", listener, target_depth=1)
+    jack.connect(TEST_GROUP, TEST_PORT, 0, "testuuid", 0)
+    send_blocks([make_block(i) for i in range(5)])
+
+    assert listener.update() == 5
+    assert len(jack.buffer) == 5
+    assert jack.get_stats().received == 5
+    assert listener.update() == 0
+    listener.close()
+
+
+def test_listener_routes_by_stream():
+    listener = make_listener()
+    jack0 = InputJack("input0", listener, target_depth=1)
+    jack1 = InputJack("input1", listener, target_depth=1)
+    jack0.connect("239.0.0.1", TEST_PORT, 0, "testuuid", 0)
+    jack1.connect("239.0.0.2", TEST_PORT, 0, "testuuid", 1)
+    send_blocks([make_block(1)], group="239.0.0.1")
+    send_blocks([make_block(2)], group="239.0.0.2")
+    send_blocks([make_block(3)], group="239.0.0.3")
+
+    assert listener.update() == 2
+    assert jack0.get_data()[0, 0] == 1
+    assert jack1.get_data()[0, 0] == 2
+    assert jack0.is_connected("testuuid", 0)
+    jack0.disconnect("testuuid", 0)
+    assert not jack0.is_patched()
+    send_blocks([make_block(1)], group="239.0.0.1")
+    assert listener.update() == 0
+    listener.close()
+
+
+def test_input_jack_sequence_accounting():
+    listener = make_listener()
+    jack = InputJack("input0", listener, target_depth=4)
+    jack.connect(TEST_GROUP, TEST_PORT, 0, "testuuid", 0)
+    frames = [make_frame(make_block(i), i) for i in range(6)]
+    bad_version = bytearray(frames[0])
+    bad_version[0] = 0xFF
+    send_frames([frames[0], frames[2], frames[1], frames[2], frames[4]])
+    send_frames([bytes(bad_version), frames[3][:-2]])
+
+    assert listener.update() == 7
+    stats = jack.get_stats()
+    assert stats.received == 4
+    assert stats.reordered == 1
+    assert stats.rejected == 2
+    assert [jack.get_data()[0, 0] for _ in range(5)] == [0, 1, 2, 2, 4]
+    assert stats.lost == 1
+    listener.close()
+
+
+def test_input_jack_conceals_missing_blocks():
+    listener = make_listener()
+    sine = 8000 * np.sin(2 * np.pi * 700 / 48000 * np.arange(20 * BLOCK_SIZE))
+    blocks = [make_block(block[:, None]) for block in np.split(sine, 20)]
+    concealed = {}
+    for i, concealment in enumerate(Concealment):
+        jack = InputJack(f"input{i}", listener, 1, concealment=concealment)
+        jack.connect(TEST_GROUP, TEST_PORT, 0, "testuuid", 0)
+        data = []
+        for sequence in range(18):
+            # Block 16 is lost
+            if sequence != 16:
+                jack.buffer.write_block()[:] = blocks[sequence]
+                jack.buffer.insert(sequence, 0, 0)
+            data.append(jack.get_data().copy())
+        # Block 17 is played once the buffer has given up on block 16
+        assert np.array_equal(jack.get_data(), blocks[17])
+        assert jack.get_stats().concealed == 2
+        concealed[concealment] = data[16].astype(int)
+
+    assert np.array_equal(concealed[Concealment.HOLD], blocks[15])
+    fade, last = np.abs(concealed[Concealment.FADE]), np.abs(blocks[15])
+    assert np.all(fade <= last) and np.all(fade[-1] < 0.7 * last[-1])
+    error = np.abs(concealed[Concealment.EXTRAPOLATE] - blocks[16])
+    assert error.max() < 1000
+    listener.close()
+
+
+def fill_buffer(buffer, sequences, arrival=0.0):
+    for sequence in sequences:
+        buffer.write_slot()[:] = make_frame(make_block(sequence), sequence)
+        buffer.insert(sequence, sequence * BLOCK_SIZE, arrival + sequence / 1000)
+
+
+def test_input_jack_reblocks_stream():
+    listener = make_listener()
+    small = InputJack("input0", listener, target_depth=1, block_size=BLOCK_SIZE)
+    large = InputJack("input1", listener, target_depth=1, block_size=2 * BLOCK_SIZE)
+    small.connect("239.0.0.1", TEST_PORT, 0, "testuuid", 0, block_size=2 * BLOCK_SIZE)
+    large.connect("239.0.0.2", TEST_PORT, 0, "testuuid", 1)
+    ramp = np.arange(2 * BLOCK_SIZE, dtype=SAMPLE_TYPE)[:, None]
+    send_blocks([make_block(ramp + 1000 * i, 2 * BLOCK_SIZE) for i in range(2)])
+    send_blocks([make_block(i) for i in range(4)], group="239.0.0.2")
+    listener.update()
+
+    assert [small.get_data()[0, 0] for _ in range(4)] == [0, 48, 1000, 1048]
+    for i in range(2):
+        data = large.get_data()
+        assert data.shape == (2 * BLOCK_SIZE, CHANNELS)
+        assert [data[0, 0], data[BLOCK_SIZE, 0]] == [2 * i, 2 * i + 1]
+    listener.close()
+
+
+def test_input_jack_resamples_drifting_stream():
+    network = EmulatedNetwork()
+    listener = InputJackListener("10.0.0.1", TEST_PORT, network.host("10.0.0.1"))
+    jack = InputJack("input0", listener, target_depth=2, resample=True)
+    jack.connect(TEST_GROUP, TEST_PORT, 0, "testuuid", 0)
+    # The sender runs 200 ppm fast, sending a ramp
+    ratio = 1.0002
+    ramp = np.arange(BLOCK_SIZE)[:, None]
+    sequence = 0
+    for tick in range(40000):
+        network.now = tick / 1000
+        while sequence / ratio <= tick:
+            jack.buffer.write_block()[:] = (sequence * BLOCK_SIZE + ramp) % 10000
+            jack.buffer.insert(sequence, sequence * BLOCK_SIZE, sequence / ratio / 1000)
+            sequence += 1
+        data = jack.get_data()
+
+    stats = jack.get_stats()
+    assert abs(stats.rate_ratio - ratio) < 5e-6
+    assert stats.underruns == 0 and stats.dropped == 0
+    assert 1 <= len(jack.buffer) <= 3
+    steps = np.diff(data[:, 0].astype(int)) % 10000
+    assert np.all((steps >= 0) & (steps <= 2))
+
+
+def test_jitter_buffer_waits_for_target_depth():
+    buffer = JitterBuffer(target_depth=3, header_size=BlockParser.header.size)
+    fill_buffer(buffer, [0, 1])
+    assert buffer.pop() is None
+    fill_buffer(buffer, [2])
+    assert [buffer.pop()[0, 0] for _ in range(3)] == [0, 1, 2]
+    assert buffer.pop() is None
+    assert buffer.stats.underruns == 1
+    assert np.all(buffer.last() == 2)
+
+
+def test_jitter_buffer_rebuilds_block_from_parity():
+    buffer = JitterBuffer(target_depth=6, header_size=BlockParser.header.size)
+    blocks = [np.arange(BLOCK_SIZE * CHANNELS, dtype=SAMPLE_TYPE) * i for i in range(8)]
+    # One block of the first group is lost, and two of the second
+    for sequence in (0, 1, 3, 4, 7):
+        buffer.write_block()[...] = blocks[sequence].reshape(BLOCK_SIZE, CHANNELS)
+        buffer.insert(sequence, sequence * BLOCK_SIZE, 0.0)
+    for first in (0, 4):
+        group = np.stack(blocks[first:][:4]).view(np.uint8)
+        buffer.insert_parity(np.bitwise_xor.reduce(group), first, 4)
+
+    played = [buffer.pop() for _ in range(3)]
+    assert np.all(played[2].reshape(-1) == blocks[2])
+    played += [buffer.pop() for _ in range(5)]
+    assert [block is None for block in played[3:]] == [False, False, True, True, False]
+    assert buffer.stats.recovered == 1 and buffer.stats.lost == 2
+
+
+def test_jitter_buffer_bounds_latency():
+    buffer = JitterBuffer(
+        target_depth=2, max_depth=8, header_size=BlockParser.header.size
+    )
+    fill_buffer(buffer, range(100))
+    assert buffer.pop()[0, 0] == 98
+    assert buffer.stats.dropped == 98
+    assert len(buffer) == 1
+
+
+def test_jitter_buffer_adapts_to_jitter():
+    buffer = JitterBuffer(target_depth=2, header_size=BlockParser.header.size)
+    for sequence in range(200):
+        buffer.write_slot()
+        buffer.insert(sequence, sequence * BLOCK_SIZE, (sequence // 5) * 0.005)
+    assert buffer.target_depth > 2
+    assert buffer.target_depth <= buffer.max_depth
+
+
+def test_output_jacks_send_in_one_batch():
+    listener = InputJackListener("127.0.0.1")
+    server = OutputJackServer("127.0.0.1")
+    outputs = [OutputJack(server, f"output{i}", 0, always_send=True) for i in range(3)]
+    inputs = [InputJack(f"input{i}", listener, target_depth=1) for i in range(3)]
+    for i, (output, input) in enumerate(zip(outputs, inputs)):
+        input.connect(*output.endpoint, 0, "testuuid", i)
+        output.send(make_block(i))
+    server.flush()
+
+    stats = server.stats
+    assert stats.packets == 3
+    if server.batch.batched:
+        assert stats.syscalls == 1
+        assert stats.syscalls_saved == 2
+    assert listener.update() == 3
+    assert [input.get_data()[0, 0] for input in inputs] == [0, 1, 2]
+    listener.close()
+
+
+def test_bundled_outputs_share_datagrams():
+    listener = InputJackListener("127.0.0.1")
+    server = OutputJackServer("127.0.0.1", bundle_mtu=2000)
+    outputs = [OutputJack(server, f"output{i}", 0, always_send=True) for i in range(3)]
+    inputs = [InputJack(f"input{i}", listener, target_depth=1) for i in range(3)]
+    for i, (output, input) in enumerate(zip(outputs, inputs)):
+        assert output.endpoint == server.bundle_endpoint
+        input.connect(*output.endpoint, 0, "testuuid", i, stream=output.stream)
+        output.send(make_block(i))
+    server.flush()
+
+    # Two frames fit in each bundle
+    assert server.stats.blocks == 3
+    assert server.stats.packets == 2
+    assert listener.update() == 3
+    assert [input.get_data()[0, 0] for input in inputs] == [0, 1, 2]
+    listener.close()
+
+
+def test_input_jacks_convert_sample_format():
+    listener = InputJackListener("127.0.0.1")
+    server = OutputJackServer("127.0.0.1")
+    formats = [SampleFormat.FLOAT32, SampleFormat.INT24, SampleFormat.INT24]
+    targets = [SampleFormat.INT16, SampleFormat.INT16, SampleFormat.INT24]
+    blocks = [
+        np.array([[0.5], [-1.0], [2.0]], dtype=np.float32),
+        np.array([[2**22], [-(2**23)], [-1]], dtype=np.int32),
+        np.array([[2**22], [-(2**23)], [-1]], dtype=np.int32),
+    ]
+    expected = [[2**14, -(2**15), 2**15 - 1], [2**14, -(2**15), -1], blocks[2][:, 0]]
+    for i, (source, target) in enumerate(zip(formats, targets)):
+        output = OutputJack(server, f"output{i}", 0, True, 3, source)
+        input = InputJack(f"input{i}", listener, 1, 3, target)
+        input.connect(
+            *output.endpoint, 0, "testuuid", i, block_size=3, sample_format=source
+        )
+        output.send(np.repeat(blocks[i], CHANNELS, axis=1))
+        server.flush()
+        listener.update()
+        data = input.get_data()
+        assert data.dtype == (np.int16 if target == SampleFormat.INT16 else np.int32)
+        assert list(data[:, CHANNELS - 1]) == list(expected[i])
+    listener.close()
+
+
+def test_compressed_blocks_round_trip():
+    listener = InputJackListener("127.0.0.1")
+    server = OutputJackServer("127.0.0.1", bundle_mtu=2000)
+    rng = np.random.default_rng(0)
+    sine = np.sin(2 * np.pi * 440 / 48000 * np.arange(BLOCK_SIZE))[:, None]
+    for format in (SampleFormat.INT16, SampleFormat.INT24):
+        scale = FULL_SCALE[format]
+        blocks = [
+            np.repeat(sine * scale / 4, CHANNELS, axis=1),
+            rng.integers(-scale, scale, (BLOCK_SIZE, CHANNELS)),
+        ]
+        output = OutputJack(
+            server, "output", 0, True, sample_format=format, compress=True
+        )
+        input = InputJack("input", listener, 1, sample_format=format)
+        input.connect(
+            *output.endpoint,
+            0,
+            "testuuid",
+            output.id,
+            stream=output.stream,
+            sample_format=format,
+        )
+        for block in blocks:
+            data = block.astype(SAMPLE_DTYPES[format])
+            output.send(data)
+            server.flush()
+            listener.update()
+            assert (input.get_data() == data).all()
+        # Noise does not compress and is sent as it is
+        assert output.get_stats().compressed == input.get_stats().compressed == 1
+        assert input.get_stats().compression > 1.5
+        assert input.get_stats().codec_time > 0
+    listener.close()
+
+
+def test_compact_frames_expand_to_full_blocks():
+    listener = InputJackListener("127.0.0.1")
+    server = OutputJackServer("127.0.0.1", bundle_mtu=2000)
+    output = OutputJack(server, "output", 0, True, compact=True)
+    input = InputJack("input", listener, 1)
+    input.connect(*output.endpoint, 0, "testuuid", 0, stream=output.stream)
+    ramp = np.arange(BLOCK_SIZE * CHANNELS, dtype=SAMPLE_TYPE).reshape(BLOCK_SIZE, -1)
+    levels = np.tile(np.arange(CHANNELS, dtype=SAMPLE_TYPE), (BLOCK_SIZE, 1))
+    blocks = [make_block(5), ramp, ramp, levels]
+    blocks += [make_block(1)] * (OutputJack.compact_refresh + 1)
+    for block in blocks:
+        output.send(block)
+        server.flush()
+        listener.update()
+        assert (input.get_data() == block).all()
+
+    # Everything but the first ramp and one refresh is sent compactly
+    compact = len(blocks) - 2
+    assert output.get_stats().compact == input.get_stats().compact == compact
+    listener.close()
+
+
+def test_unpatched_output_only_sends_keepalive():
+    server = OutputJackServer("127.0.0.1")
+    output = OutputJack(server, "output0", 0)
+    for _ in range(JACK_KEEPALIVE_INTERVAL):
+        output.send(make_block(0))
+        server.flush()
+    assert output.get_stats().sent == 1
+    assert output.get_stats().suppressed == JACK_KEEPALIVE_INTERVAL - 1
+
+    output.connect("testuuid", 0)
+    output.send(make_block(0))
+    assert output.get_stats().sent == 2
+    server.flush()
+
+
+def test_local_input_reads_shared_memory():
+    listener = make_listener()
+    server = OutputJackServer("127.0.0.1")
+    output = OutputJack(server, "output0", 0)
+    input = InputJack("input0", listener, target_depth=1)
+    input.connect(*output.endpoint, 0, "testuuid", 0, shm=output.shared_writer.name)
+    output.connect("testuuid", 0, local=True)
+    for i in range(3):
+        output.send(make_block(i))
+    server.flush()
+
+    assert server.stats.packets == 0
+    input.update()
+    assert [input.get_data()[0, 0] for _ in range(3)] == [0, 1, 2]
+    assert input.get_stats().received == 3
+    input.clear()
+    listener.close()
+
+
+def test_missing_shared_memory_falls_back_to_network():
+    listener = InputJackListener("127.0.0.1")
+    server = OutputJackServer("127.0.0.1")
+    output = OutputJack(server, "output0", 0)
+    input = InputJack("input0", listener, target_depth=1)
+    input.connect(*output.endpoint, 0, "testuuid", 0, shm="brain_missing")
+    assert input.shm_missing and input.shared_reader is None
+    output.connect("testuuid", 0, local=True)
+    # The input's module then reports it as remote, which moves it to the network
+    output.connect("testuuid", 0)
+    assert not output.local_jacks
+    output.send(make_block(5))
+    server.flush()
+    listener.update()
+    assert input.get_data()[0, 0] == 5
+    listener.close()
+
+
+def test_input_in_same_interpreter_is_handed_blocks():
+    listener = make_listener()
+    server = OutputJackServer("127.0.0.1")
+    output = OutputJack(server, "output0", 0)
+    input = InputJack("input0", listener, target_depth=1)
+    local_outputs[("outputuuid", output.id)] = output
+    local_inputs[("inputuuid", input.id)] = input
+    input.connect(*output.endpoint, 0, "outputuuid", output.id)
+    output.connect("inputuuid", input.id, local=True)
+    for i in range(3):
+        output.send(make_block(i))
+    server.flush()
+
+    assert server.stats.packets == 0
+    assert output.shared_writer.counter[0] == 0
+    input.update()
+    assert [input.get_data()[0, 0] for _ in range(3)] == [0, 1, 2]
+    assert input.get_stats().lost == 0
+    output.disconnect("inputuuid", input.id)
+    input.clear()
+    assert not output.direct_jacks and not input.direct
+    listener.close()